@@ -0,0 +1,161 @@
+import errno
+import heapq
+import ipaddress
+from collections import OrderedDict
+
+# Errors that mean we, not the target, are out of resources
+RESOURCE_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL, errno.EAGAIN}
+
+class RttEstimator:
+    """Smoothed RTT / RTT variance in the style of TCP's retransmission timer (RFC 6298)."""
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.samples += 1
+
+    def rto(self, k=4):
+        return self.srtt + k * self.rttvar
+
+class AdaptiveController:
+    """Derives per-probe timeouts from per-network RTT and tunes concurrency AIMD-style.
+
+    RTT samples come from connects that got an answer (open or refused); timeouts
+    give no sample. Every `window` probes, concurrency is halved if any resource
+    errors (EMFILE/ENOBUFS/...) were seen, cut by a quarter if the timeout rate jumped
+    above its running baseline, and otherwise grown by `increase` (doubled instead
+    while still in slow start). A resource error
+    triggers the cut early, at most once per `concurrency` probes.
+    """
+    def __init__(self, base_timeout=0.5, min_timeout=0.25, max_timeout=3.0,
+                 concurrency=100, min_concurrency=8, max_concurrency=10000,
+                 increase=8, window=256, timeout_margin=0.2, max_networks=65536):
+        self.base_timeout = base_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.window = window
+        self.timeout_margin = timeout_margin
+        self.max_networks = max_networks
+        self.networks = OrderedDict()  # network key -> RttEstimator, LRU capped
+        self.overall = RttEstimator()
+        self.timeout_baseline = None
+        self.totals = {"open": 0, "refused": 0, "timeout": 0, "error": 0, "resource": 0}
+        self.increases = 0
+        self.decreases = 0
+        # Double per window until the first sign of trouble, then go additive
+        self.slow_start = True
+        self._window = dict.fromkeys(self.totals, 0)
+        self._window_count = 0
+        self._since_cut = 0
+
+    @staticmethod
+    def network_key(ip):
+        """Groups addresses by /24 (IPv4) or /64 (IPv6); hostnames stand alone."""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return ip
+        prefix = 24 if addr.version == 4 else 64
+        return str(ipaddress.ip_network(f"{addr}/{prefix}", strict=False))
+
+    def timeout_for(self, ip, fallback=None):
+        estimator = self.networks.get(self.network_key(ip))
+        if estimator is not None and estimator.srtt is not None:
+            return min(self.max_timeout, max(self.min_timeout, estimator.rto()))
+        # Unseen network: fast answers from elsewhere (e.g. the LAN) say nothing about
+        # its RTT, so never go below the configured timeout
+        timeout = fallback if fallback is not None else self.base_timeout
+        if self.overall.srtt is not None:
+            timeout = max(timeout, min(self.max_timeout, self.overall.rto()))
+        return timeout
+
+    def observe(self, ip, outcome, rtt=None):
+        """Records one probe outcome: open, refused, timeout, error or resource."""
+        if rtt is not None and outcome in ("open", "refused"):
+            key = self.network_key(ip)
+            estimator = self.networks.get(key)
+            if estimator is None:
+                estimator = self.networks[key] = RttEstimator()
+                if len(self.networks) > self.max_networks:
+                    self.networks.popitem(last=False)
+            else:
+                self.networks.move_to_end(key)
+            estimator.update(rtt)
+            self.overall.update(rtt)
+
+        self.totals[outcome] += 1
+        self._window[outcome] += 1
+        self._window_count += 1
+        self._since_cut += 1
+        # React to resource errors at once, but cut at most once per window's worth of probes
+        if outcome == "resource" and self._since_cut >= self.concurrency:
+            self._adjust()
+        elif self._window_count >= self.window:
+            self._adjust()
+
+    def _adjust(self):
+        counts, n = self._window, self._window_count
+        timeout_rate = counts["timeout"] / n if n else 0.0
+        if counts["resource"]:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            self.decreases += 1
+            self.slow_start = False
+            self._since_cut = 0
+        elif self.timeout_baseline is not None and timeout_rate > self.timeout_baseline + self.timeout_margin:
+            self.concurrency = max(self.min_concurrency, int(self.concurrency * 0.75))
+            self.decreases += 1
+            self.slow_start = False
+            self._since_cut = 0
+        else:
+            step = self.concurrency if self.slow_start else self.increase
+            self.concurrency = min(self.max_concurrency, self.concurrency + step)
+            self.increases += 1
+        # Sparse ranges time out a lot by nature; only a rise over the baseline is congestion
+        if n >= self.window // 2:
+            if self.timeout_baseline is None:
+                self.timeout_baseline = timeout_rate
+            else:
+                self.timeout_baseline = 0.8 * self.timeout_baseline + 0.2 * timeout_rate
+        self._window = dict.fromkeys(self.totals, 0)
+        self._window_count = 0
+
+    def snapshot(self, top=10):
+        """Current controller state, including the busiest networks' RTT estimates."""
+        busiest = heapq.nlargest(top, self.networks.items(), key=lambda item: item[1].samples)
+        return {
+            "concurrency": self.concurrency,
+            "slow_start": self.slow_start,
+            "default_timeout": round(self.timeout_for("", self.base_timeout), 4),
+            "srtt": round(self.overall.srtt, 4) if self.overall.srtt is not None else None,
+            "rttvar": round(self.overall.rttvar, 4) if self.overall.rttvar is not None else None,
+            "timeout_baseline": round(self.timeout_baseline, 3) if self.timeout_baseline is not None else None,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "outcomes": dict(self.totals),
+            "networks_tracked": len(self.networks),
+            "networks": [
+                {
+                    "network": key,
+                    "srtt": round(est.srtt, 4),
+                    "rttvar": round(est.rttvar, 4),
+                    "timeout": round(min(self.max_timeout, max(self.min_timeout, est.rto())), 4),
+                    "samples": est.samples,
+                }
+                for key, est in busiest
+            ],
+        }
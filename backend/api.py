@@ -1,79 +1,521 @@
-from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+import asyncio
+import logging
+import queue
 import sqlite3
 import json
 import os
-from scanner_core import AsyncScanner
+import time
+from collections import deque
+
+try:
+    import orjson  # optional; several times faster on large /devices pages
+except ImportError:
+    orjson = None
+from jobs import ScanJob, ScanJobManager, CHECKPOINT_INTERVAL
+from scanner_core import Prefilter, SENTINEL_PORTS
+from incremental import Rescan
 from intel_bridge import IntelligenceBridge
+from resolver import Resolver
+from persistence import get_writer, connect
+from events import EventBus, format_sse
+from metrics import REGISTRY, CONTENT_TYPE
+from profiler import SamplingProfiler, collapsed
+from bitmap import ScanResults
+from export import FORMATS, open_export, encode_rows, gzip_chunks
+from db import (init_db, select_devices, DEVICE_COLUMNS, UPSERT_HOST, UPSERT_PORT, DELETE_PORT, UPSERT_PORT_STATE,
+                INSERT_CHANGE, INSERT_SCAN_RESULT, SELECT_SCAN_RESULTS, INSERT_SCAN_JOB, UPDATE_SCAN_JOB_STATUS,
+                UPDATE_SCAN_JOB_CHECKPOINT, SELECT_RESUMABLE_JOBS)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="GhostScan API")
 
 # Pathing for static files
 BASE_DIR = os.path.dirname(__file__)
 DIST_DIR = os.path.abspath(os.path.join(BASE_DIR, "../frontend/dist"))
-DB_PATH = os.path.join(BASE_DIR, "ghostscan.db")
+DB_PATH = os.environ.get("GHOSTSCAN_DB", os.path.join(BASE_DIR, "ghostscan.db"))
 
 class ScanRequest(BaseModel):
-    ips: List[str]
+    ips: List[str] # addresses, CIDR ranges or hostnames
     ports: List[int]
+    shards: int = 1 # worker processes; 0 = one per CPU
+    adaptive: bool = True # RTT-derived timeouts and AIMD concurrency
+    profile: bool = False # sample the engine's stacks while this job runs
+    prefilter: bool = False # probe sentinel ports first, full list only on live hosts
+    sentinel_ports: List[int] = list(SENTINEL_PORTS)
+    sentinel_timeout: Optional[float] = None # seconds; defaults to min(scan timeout, 0.3)
+    incremental: bool = False # probe stale/recently changed (host, port) pairs, report diffs only
+    probe_budget: Optional[int] = None # incremental: max probes this run
+    min_age: float = 0.0 # incremental: skip pairs checked less than this many seconds ago
+    banners: bool = False # read a service banner on each open port's probe connection
+    per_host: Optional[int] = None # probes in flight per host; defaults to scanner_core.PER_HOST_LIMIT
+    checkpoint_interval: float = CHECKPOINT_INTERVAL # seconds between resumable checkpoints; 0 = none
+
+# Shared across scans so the HTTP pool, caches and in-flight lookups are reused
+db_writer = get_writer(DB_PATH)
+intel_bridge = IntelligenceBridge(db_path=DB_PATH, writer=db_writer)
+# Hostname targets; the cache is shared by every scan request
+resolver = Resolver()
+
+# Live feed for dashboards: discoveries, job progress and counter deltas
+event_bus = EventBus()
+PROGRESS_INTERVAL = 0.5
+last_counters = {}
+
+COUNTERS_SQL = "SELECT name, value FROM counters WHERE name IN ('hosts', 'ports')"
+
+def publish_counters(counters):
+    delta = {name: value - last_counters.get(name, 0) for name, value in counters.items()}
+    if any(delta.values()):
+        last_counters.update(counters)
+        event_bus.publish("counters", {"device_count": counters.get("hosts", 0), "port_count": counters.get("ports", 0), "delta": delta})
+
+def read_counters(conn):
+    # Runs on the writer thread right after each committed batch
+    event_bus.call_threadsafe(publish_counters, dict(conn.execute(COUNTERS_SQL)))
+
+async def publish_progress(job: ScanJob):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        event_bus.publish("job", job.snapshot())
+
+async def run_scan_task(job: ScanJob):
+    if job.rescan is not None:
+        return await run_rescan_task(job)
+    # Findings are upserted as they stream in; a full writer queue slows the scan down
+    active = {ip for ip, _ in job.results.items()}  # non-empty when resuming from a checkpoint
+    services_by_ip = {}
+    progress = asyncio.create_task(publish_progress(job))
+    checkpoints = asyncio.create_task(save_checkpoints(job)) if job.cursor is not None else None
+    if job.cursor is not None:
+        stream = job.scanner.scan_probes(job.cursor)
+    else:
+        stream = job.scanner.scan_stream(job.ips, job.ports, prefilter=job.prefilter)
+    try:
+        async for ip, port, _ in stream:
+            job.record(ip, port)
+            service = pop_service(job, ip, port, services_by_ip)
+            event_bus.publish("discovery", {"job_id": job.id, "ip": ip, "port": port, "service": service,
+                                            "hostnames": job.hostnames.get(ip)})
+            if ip not in active:
+                active.add(ip)
+                await db_writer.submit_async(UPSERT_HOST, (ip, None, None, "scanner"))
+            await db_writer.submit_async(UPSERT_PORT, (ip, port))
+    finally:
+        progress.cancel()
+        if checkpoints is not None:
+            checkpoints.cancel()
+            # Also on cancellation: a shutdown resumes from here
+            await save_checkpoint(job)
+
+    await save_results(job)
+    await enrich_hosts(active, services_by_ip)
+
+async def run_rescan_task(job: ScanJob):
+    # Incremental mode: only state bookkeeping and diffs reach the DB and the event feed
+    await db_writer.flush_async()  # plan against every state row written so far
+    source = await asyncio.to_thread(job.rescan.plan, DB_PATH, job.ips, job.ports)
+    opened = set()
+    services_by_ip = {}
+    progress = asyncio.create_task(publish_progress(job))
+    try:
+        async for ip, port, is_open in job.scanner.scan_probes(source, open_only=False):
+            if is_open:
+                job.record(ip, port)
+                pop_service(job, ip, port, services_by_ip)
+            await db_writer.submit_many_async(UPSERT_PORT_STATE, source.pop_updates())
+            for diff in source.pop_diffs():
+                await apply_diff(job, diff, opened)
+    finally:
+        progress.cancel()
+
+    await save_results(job)
+    await enrich_hosts(opened | services_by_ip.keys(), services_by_ip)
+
+async def save_checkpoints(job: ScanJob):
+    while True:
+        await asyncio.sleep(job.checkpoint_interval)
+        await save_checkpoint(job)
+
+async def save_checkpoint(job: ScanJob):
+    # Results go in ahead of the position, so a crash in between only re-probes
+    position, dirty = job.checkpoint()
+    await db_writer.submit_many_async(INSERT_SCAN_RESULT, [(job.id, ip, job.results.get(ip).to_blob()) for ip in dirty])
+    if position is not None:
+        await db_writer.submit_async(UPDATE_SCAN_JOB_CHECKPOINT, (json.dumps(position), job.open_found, time.time(), job.id))
 
-async def run_scan_task(ips: List[str], ports: List[int]):
-    scanner = AsyncScanner(concurrency=100)
-    intel_bridge = IntelligenceBridge()
-    
-    results = await scanner.scan_range(ips, ports)
-    
+async def save_results(job: ScanJob):
+    # Kept after the job is pruned so /scans/{id}/results can still compare against it
+    await db_writer.submit_many_async(INSERT_SCAN_RESULT, [(job.id, ip, blob) for ip, blob in job.results.to_rows()])
+
+def pop_service(job: ScanJob, ip, port, services_by_ip):
+    # Banner results only exist for single-process jobs started with banners=True
+    service = getattr(job.scanner, "services", {}).pop((ip, port), None)
+    if service is not None:
+        services_by_ip.setdefault(ip, []).append(service)
+    return service
+
+async def apply_diff(job: ScanJob, diff, opened):
+    ip, port, change = diff["ip"], diff["port"], diff["change"]
+    if change == "opened":
+        if ip not in opened:
+            opened.add(ip)
+            await db_writer.submit_async(UPSERT_HOST, (ip, None, None, "scanner"))
+        await db_writer.submit_async(UPSERT_PORT, (ip, port))
+        event_bus.publish("discovery", {"job_id": job.id, "ip": ip, "port": port})
+    elif change == "closed":
+        await db_writer.submit_async(DELETE_PORT, (ip, port))
+    elif change == "vanished":
+        await db_writer.submit_many_async(DELETE_PORT, [(ip, silent) for silent in diff["ports"]])
+    await db_writer.submit_async(INSERT_CHANGE, (ip, port, change, job.id, diff["at"]))
+    event_bus.publish("diff", {"job_id": job.id, **diff})
+
+async def enrich_hosts(ips, services_by_ip=None):
+    # Fetch intel for active devices concurrently
+    intel_by_ip = await intel_bridge.fetch_many(ips)
+    services_by_ip = services_by_ip or {}
+
+    for ip in ips:
+        intel = intel_by_ip[ip]
+        # What the ports actually answered beats the intel feed's guess
+        services = sorted(services_by_ip[ip], key=lambda s: s["port"]) if ip in services_by_ip else intel.get("services", [])
+        await db_writer.submit_async(UPSERT_HOST, (
+            ip,
+            json.dumps(services),
+            intel.get("location", "Unknown"),
+            "scanner"
+        ))
+        event_bus.publish("device", {
+            "ip": ip,
+            "services": services,
+            "location": intel.get("location", "Unknown"),
+        })
+
+# Opt-in per job; samples the event loop thread the scans run on
+profiler = SamplingProfiler()
+
+# Job rows that found the writer queue full; a task writes them, in order, as it drains
+job_writes = deque()
+job_writes_task = None
+
+def submit_job_write(sql, params):
+    """Queues a job row from the event loop without waiting for room in the writer queue."""
+    global job_writes_task
+    if not job_writes:
+        try:
+            db_writer.submit_nowait(sql, params)
+            return
+        except queue.Full:
+            pass
+    job_writes.append((sql, params))
+    if job_writes_task is None or job_writes_task.done():
+        job_writes_task = asyncio.create_task(drain_job_writes())
+
+async def drain_job_writes():
+    while job_writes:
+        await db_writer.submit_async(*job_writes.popleft())
+
+def on_job_change(job):
+    if job.finished:
+        profiler.disable(job)
+    if job.status == "queued":
+        submit_job_write(INSERT_SCAN_JOB, (job.id, json.dumps(job.spec()), job.status, job.created_at))
+    submit_job_write(UPDATE_SCAN_JOB_STATUS, (job.status, time.time(), job.id))
+    event_bus.publish("job", job.snapshot())
+
+# One scheduler per process: every job draws from the same socket budget
+job_manager = ScanJobManager(run_scan_task, listener=on_job_change)
+
+def count_jobs_by_status():
+    counts = {status: 0 for status in ("queued", "running", "completed", "cancelled", "failed", "interrupted")}
+    for job in job_manager.jobs.values():
+        counts[job.status] += 1
+    return [((status,), n) for status, n in counts.items()]
+
+# Scrape-time gauges over the live engine state
+REGISTRY.gauge("ghostscan_probes_in_flight", "Connect probes currently in flight across running jobs.",
+               collect=lambda: sum(getattr(job.scanner, "in_flight", 0) for job in job_manager.running))
+REGISTRY.gauge("ghostscan_semaphore_waiters", "Probes and lookups waiting on a concurrency limit.", labels=("semaphore",),
+               collect=lambda: [(("scanner",), sum(getattr(job.scanner, "waiting", 0) + getattr(job.scanner, "probes_held", 0)
+                                                   for job in job_manager.running)),
+                                (("enrichment",), intel_bridge.waiting)])
+REGISTRY.gauge("ghostscan_hosts_capped", "Target hosts at their per-host in-flight cap across running jobs.",
+               collect=lambda: sum(getattr(job.scanner, "hosts_capped", 0) for job in job_manager.running))
+REGISTRY.gauge("ghostscan_queue_depth", "Items waiting in the engine's internal queues.", labels=("queue",),
+               collect=lambda: [(("db_writer",), db_writer.depth),
+                                (("scan_jobs",), len(job_manager.queue)),
+                                (("enrichment_inflight",), len(intel_bridge._inflight))])
+REGISTRY.gauge("ghostscan_scan_jobs", "Tracked scan jobs by status.", labels=("status",), collect=count_jobs_by_status)
+REGISTRY.gauge("ghostscan_socket_budget", "Global probe socket budget shared by running jobs.",
+               collect=lambda: job_manager.budget)
+
+@app.on_event("startup")
+async def prepare_database():
+    init_db(DB_PATH)
     conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    for ip, open_ports in results.items():
-        if open_ports:
-            # Fetch intel for active devices
-            intel = await intel_bridge.fetch_ip_intel(ip)
-            
-            cursor.execute('''
-                INSERT INTO devices (ip, ports, services, location, source)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                ip, 
-                ",".join(map(str, open_ports)), 
-                json.dumps(intel.get("services", [])),
-                intel.get("location", "Unknown"),
-                "scanner"
-            ))
-            
-            # Cache full intel
-            cursor.execute('''
-                INSERT OR REPLACE INTO intel_cache (ip, data)
-                VALUES (?, ?)
-            ''', (ip, json.dumps(intel)))
-            
-    conn.commit()
+    last_counters.update(conn.execute(COUNTERS_SQL))
     conn.close()
+    event_bus.bind(asyncio.get_running_loop())
+    profiler.bind()
+    db_writer.commit_listeners.append(read_counters)
+    resume_jobs()
+
+def resume_jobs():
+    """Re-queues jobs a previous run left unfinished, from their last checkpoint."""
+    conn = connect(DB_PATH)
+    try:
+        for job_id, spec, position, open_found in conn.execute(SELECT_RESUMABLE_JOBS).fetchall():
+            try:
+                job = ScanJob.from_spec(json.loads(spec), job_id=job_id)
+            except (ValueError, TypeError) as e:
+                logger.error(f"Cannot resume scan job {job_id}: {e}")
+                db_writer.submit(UPDATE_SCAN_JOB_STATUS, ("failed", time.time(), job_id))
+                continue
+            if position:
+                job.restore(json.loads(position), open_found, ScanResults.from_rows(conn.execute(SELECT_SCAN_RESULTS, (job_id,))))
+            logger.info(f"Resuming scan job {job_id} at probe {job.probes_offset}")
+            job_manager.enqueue(job)
+    finally:
+        conn.close()
+
+@app.on_event("shutdown")
+async def close_shared_resources():
+    await job_manager.shutdown()
+    if job_writes_task is not None:
+        await job_writes_task
+    await intel_bridge.close()
+    db_writer.close()
 
 @app.post("/scan")
-async def start_scan(request: ScanRequest, background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_scan_task, request.ips, request.ports)
-    return {"status": "Scan started in background", "target_count": len(request.ips)}
+async def start_scan(request: ScanRequest):
+    if request.shards < 0:
+        raise HTTPException(status_code=422, detail="shards must be >= 0")
+    if not all(0 < port < 65536 for port in request.ports):
+        raise HTTPException(status_code=422, detail="ports must be between 1 and 65535")
+    prefilter = None
+    if request.prefilter:
+        if request.shards != 1:
+            raise HTTPException(status_code=422, detail="prefilter is only supported with shards=1")
+        if not request.sentinel_ports:
+            raise HTTPException(status_code=422, detail="prefilter needs at least one sentinel port")
+        prefilter = Prefilter(request.sentinel_ports, request.sentinel_timeout)
+    rescan = None
+    if request.incremental:
+        if request.shards != 1 or request.prefilter:
+            raise HTTPException(status_code=422, detail="incremental scans need shards=1 and no prefilter")
+        if request.probe_budget is not None and request.probe_budget < 1:
+            raise HTTPException(status_code=422, detail="probe_budget must be >= 1")
+        rescan = Rescan(request.probe_budget, request.min_age)
+    if request.per_host is not None and request.per_host < 1:
+        raise HTTPException(status_code=422, detail="per_host must be >= 1")
+    if request.checkpoint_interval < 0:
+        raise HTTPException(status_code=422, detail="checkpoint_interval must be >= 0")
+    if request.banners and request.shards != 1:
+        raise HTTPException(status_code=422, detail="banner grabbing is only supported with shards=1")
+    # Resolved up front so the stored job spec (and any resume) sees fixed addresses
+    targets, hostnames, unresolved = await resolver.expand(request.ips)
+    if not targets:
+        raise HTTPException(status_code=422, detail={"error": "No target could be resolved", "unresolved": unresolved})
+    job = job_manager.submit(targets, request.ports, shards=request.shards, adaptive=request.adaptive,
+                             prefilter=prefilter, rescan=rescan, banners=request.banners, per_host=request.per_host,
+                             checkpoint_interval=request.checkpoint_interval, hostnames=hostnames)
+    if request.profile:
+        profiler.enable(job)
+    return {"status": f"Scan {job.status}", "job_id": job.id, "target_count": len(targets), "unresolved": unresolved}
 
-@app.get("/devices")
-async def get_devices():
+@app.get("/scans")
+async def list_scans():
+    return [job.snapshot() for job in job_manager.jobs.values()]
+
+@app.get("/scans/{job_id}")
+async def get_scan(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job.snapshot()
+
+@app.delete("/scans/{job_id}")
+async def cancel_scan(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job.snapshot()
+
+@app.post("/scans/{job_id}/profile")
+async def start_profile(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    if job.finished:
+        raise HTTPException(status_code=409, detail="Scan job already finished")
+    profiler.enable(job)
+    return job.snapshot()
+
+@app.delete("/scans/{job_id}/profile")
+async def stop_profile(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    profiler.disable(job)
+    return job.snapshot()
+
+@app.get("/scans/{job_id}/profile", response_class=PlainTextResponse)
+async def get_profile(job_id: str, limit: Optional[int] = None):
+    """Collapsed stacks (flamegraph.pl / speedscope input), busiest first."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    if job.profile is None:
+        raise HTTPException(status_code=404, detail="Profiling was never enabled for this job")
+    return PlainTextResponse(collapsed(job.profile, limit))
+
+def read_scan_results(job_id):
+    conn = connect(DB_PATH)
+    try:
+        return ScanResults.from_rows(conn.execute(SELECT_SCAN_RESULTS, (job_id,)))
+    finally:
+        conn.close()
+
+async def load_results(job_id):
+    job = job_manager.get(job_id)
+    if job is not None:
+        return job.results
+    results = await asyncio.to_thread(read_scan_results, job_id)
+    if not results:
+        raise HTTPException(status_code=404, detail=f"No results for scan job {job_id}")
+    return results
+
+RESULT_OPS = {"union": ScanResults.union, "intersection": ScanResults.intersection, "difference": ScanResults.difference}
+
+@app.get("/scans/{job_id}/results")
+async def get_scan_results(job_id: str, has: List[int] = Query([]), lacks: List[int] = Query([]),
+                           other: Optional[str] = None, op: str = "difference"):
+    """Open ports per host for a job, as {ip: [ports]}.
+
+    `other` combines it with another job's results (`op`: union, intersection
+    or difference, this job first); `has` / `lacks` then keep hosts with all of
+    / none of those ports open, e.g. ?has=22&lacks=443.
+    """
+    if op not in RESULT_OPS:
+        raise HTTPException(status_code=422, detail=f"op must be one of {', '.join(RESULT_OPS)}")
+    if any(not 0 <= port <= 65535 for port in has + lacks):
+        raise HTTPException(status_code=422, detail="ports must be within 0-65535")
+    results = await load_results(job_id)
+    if other is not None:
+        results = RESULT_OPS[op](results, await load_results(other))
+    if has or lacks:
+        results = results.select(has, lacks)
+    return Response(dump_json(results.to_dict()), media_type="application/json")
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the engine's counters, histograms and gauges."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/events")
+async def stream_events(request: Request, cursor: Optional[int] = None):
+    """Server-sent events; resumes after `cursor` or the Last-Event-ID header."""
+    if cursor is None and request.headers.get("last-event-id", "").isdigit():
+        cursor = int(request.headers["last-event-id"])
+
+    start = event_bus.seq if cursor is None else cursor
+
+    async def frames():
+        yield format_sse((None, "hello", {"cursor": start, "device_count": last_counters.get("hosts", 0)}))
+        async for event in event_bus.subscribe(start):
+            if await request.is_disconnected():
+                break
+            yield format_sse(event)
+
+    return StreamingResponse(frames(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/changes")
+async def get_changes(since: int = 0, limit: int = 500):
+    """Diffs recorded by incremental rescans after change id `since`, oldest first."""
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM devices ORDER BY last_seen DESC LIMIT 100")
-    rows = cursor.fetchall()
+    rows = conn.execute(
+        "SELECT id, ip, port, change, job_id, at FROM port_changes WHERE id > ? ORDER BY id LIMIT ?",
+        (since, min(max(limit, 1), 5000)),
+    ).fetchall()
     conn.close()
     return [dict(row) for row in rows]
 
+MAX_PAGE_SIZE = 1000
+
+def dump_json(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+def read_devices_page(if_none_match, **query):
+    conn = connect(DB_PATH)
+    try:
+        version = conn.execute("SELECT value FROM counters WHERE name = 'version'").fetchone()[0]
+        # Any hosts/host_ports write bumps the version, so it validates every page and filter
+        etag = f'W/"{version}"'
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return etag, None, None
+        rows, next_cursor = select_devices(conn, **query)
+    finally:
+        conn.close()
+    return etag, [dict(zip(DEVICE_COLUMNS, row)) for row in rows], next_cursor
+
+@app.get("/devices")
+async def get_devices(request: Request, limit: int = 100, cursor: Optional[str] = None,
+                      port: Optional[int] = None, cidr: Optional[str] = None, source: Optional[str] = None,
+                      since: Optional[str] = None, until: Optional[str] = None):
+    """Devices, newest first. The next page's cursor comes back in the X-Next-Cursor header."""
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    try:
+        etag, devices, next_cursor = await asyncio.to_thread(
+            read_devices_page, request.headers.get("if-none-match"), limit=limit, cursor=cursor,
+            port=port, cidr=cidr, source=source, since=since, until=until)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if devices is None:
+        return Response(status_code=304, headers=headers)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(dump_json(devices), media_type="application/json", headers=headers)
+
+@app.get("/export")
+async def export_devices(request: Request, fmt: str = Query("ndjson", alias="format"), after: Optional[str] = None,
+                         port: Optional[int] = None, cidr: Optional[str] = None, source: Optional[str] = None,
+                         since: Optional[str] = None, until: Optional[str] = None, gzip: Optional[bool] = None):
+    """Every matching device as a chunked NDJSON or CSV stream, oldest last_seen first.
+
+    Reads one WAL snapshot, so scans keep writing meanwhile. Pass the
+    X-Next-Cursor header back as `after` to get only what changed since.
+    Compressed when `gzip` is set, or by default if the client accepts gzip.
+    """
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {', '.join(FORMATS)}")
+    try:
+        conn, rows, next_cursor = await asyncio.to_thread(
+            open_export, DB_PATH, after=after, port=port, cidr=cidr, source=source, since=since, until=until)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    chunks = encode_rows(conn, rows, fmt)
+    headers = {"Cache-Control": "no-cache"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if gzip if gzip is not None else "gzip" in request.headers.get("accept-encoding", ""):
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=FORMATS[fmt], headers=headers)
+
 @app.get("/status")
 async def get_status():
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM devices")
+    cursor.execute("SELECT value FROM counters WHERE name = 'hosts'")
     device_count = cursor.fetchone()[0]
     conn.close()
     return {"device_count": device_count, "engine": "GhostScan v1.0"}
@@ -0,0 +1,101 @@
+import asyncio
+import re
+
+# Bytes kept from a banner, and how long a probe may spend reading one
+MAX_BANNER = 512
+BANNER_TIMEOUT = 0.5
+
+# Ports where the client speaks first; everything else is read passively
+NUDGES = {
+    80: b"HEAD / HTTP/1.0\r\n\r\n",
+    81: b"HEAD / HTTP/1.0\r\n\r\n",
+    3000: b"HEAD / HTTP/1.0\r\n\r\n",
+    5000: b"HEAD / HTTP/1.0\r\n\r\n",
+    8000: b"HEAD / HTTP/1.0\r\n\r\n",
+    8001: b"HEAD / HTTP/1.0\r\n\r\n",
+    8008: b"HEAD / HTTP/1.0\r\n\r\n",
+    8080: b"HEAD / HTTP/1.0\r\n\r\n",
+    8888: b"HEAD / HTTP/1.0\r\n\r\n",
+    6379: b"PING\r\n",
+    11211: b"version\r\n",
+}
+
+# (pattern, service, product group) checked in order; product group 0 means none
+SIGNATURES = [
+    (re.compile(rb"^SSH-[\d.]+-([^\s\r\n]+)"), "SSH", 1),
+    (re.compile(rb"^HTTP/[\d.]+ \d{3}.*?\r\nServer: *([^\r\n]+)", re.S | re.I), "HTTP", 1),
+    (re.compile(rb"^HTTP/[\d.]+ \d{3}"), "HTTP", 0),
+    (re.compile(rb"^220[ -][^\r\n]*?(vsFTPd [\d.]+|ProFTPD [\d.]+|FileZilla Server[^\r\n]*|Pure-FTPd)", re.I), "FTP", 1),
+    (re.compile(rb"^220[ -][^\r\n]*FTP", re.I), "FTP", 0),
+    (re.compile(rb"^220[ -](\S+) E?SMTP[^\r\n]*", re.I), "SMTP", 1),
+    (re.compile(rb"^220[ -][^\r\n]*SMTP", re.I), "SMTP", 0),
+    (re.compile(rb"^\+OK[^\r\n]*"), "POP3", 0),
+    (re.compile(rb"^\* OK[^\r\n]*IMAP", re.I), "IMAP", 0),
+    (re.compile(rb"^.\x00\x00\x00\x0a([\d.]+[^\x00]*)\x00", re.S), "MySQL", 1),
+    (re.compile(rb"^RFB (\d{3}\.\d{3})"), "VNC", 1),
+    (re.compile(rb"^\+PONG|^-NOAUTH|^-DENIED"), "Redis", 0),
+    (re.compile(rb"^VERSION ([\d.]+)"), "Memcached", 1),
+    (re.compile(rb"^\xff[\xfb-\xfe]"), "Telnet", 0),
+]
+
+# Fallback for services that stay silent (TLS, RDP, ...) or didn't answer in time
+PORT_HINTS = {
+    21: "FTP", 22: "SSH", 23: "Telnet", 25: "SMTP", 53: "DNS", 80: "HTTP", 110: "POP3",
+    143: "IMAP", 443: "HTTPS", 445: "SMB", 587: "SMTP", 993: "IMAPS", 995: "POP3S",
+    1433: "MSSQL", 3306: "MySQL", 3389: "RDP", 5432: "PostgreSQL", 5900: "VNC",
+    6379: "Redis", 8080: "HTTP", 8443: "HTTPS", 11211: "Memcached", 27017: "MongoDB",
+}
+
+def classify(port, banner):
+    """Matches a banner against SIGNATURES; falls back to the port's usual service."""
+    info = {"port": port}
+    if banner:
+        for pattern, service, group in SIGNATURES:
+            match = pattern.search(banner)
+            if match:
+                info["service"] = service
+                if group:
+                    info["product"] = match.group(group).decode("latin-1").strip()
+                break
+        # First line only, printable, for display
+        first_line = banner.split(b"\n", 1)[0].decode("latin-1")
+        info["banner"] = "".join(ch if ch.isprintable() else "." for ch in first_line.rstrip("\r"))[:128]
+    if "service" not in info:
+        info["service"] = PORT_HINTS.get(port, "unknown")
+        info["guess"] = True
+    return info
+
+def _complete(data):
+    # HTTP needs its headers for the Server line; other text protocols need one line
+    if data.startswith(b"HTTP/"):
+        return b"\r\n\r\n" in data
+    return b"\n" in data or any(pattern.search(data) for pattern, _, _ in SIGNATURES)
+
+async def grab_banner(reader, writer, port, timeout=BANNER_TIMEOUT, max_bytes=MAX_BANNER):
+    """Reads up to `max_bytes` from an open connection within `timeout` seconds.
+
+    Client-speaks-first ports get their NUDGES payload up front. Returns the
+    raw bytes (possibly empty); never raises for slow or rude servers.
+    """
+    data = b""
+    loop = asyncio.get_running_loop()
+    # One deadline for the nudge and the read, so a probe holds its slot at most `timeout`
+    deadline = loop.time() + timeout
+    try:
+        nudge = NUDGES.get(port)
+        if nudge:
+            writer.write(nudge)
+            await asyncio.wait_for(writer.drain(), timeout)
+        while len(data) < max_bytes:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            chunk = await asyncio.wait_for(reader.read(max_bytes - len(data)), remaining)
+            if not chunk:
+                break
+            data += chunk
+            if _complete(data):
+                break
+    except (asyncio.TimeoutError, OSError):
+        pass
+    return data
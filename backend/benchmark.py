@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+from scanner_core import AsyncScanner
+from sharding import ShardedScanner
+from adaptive import AdaptiveController
+from persistence import BatchWriter
+import db
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+NATIVE_APP = os.path.abspath(os.path.join(BASE_DIR, "..", "native", "app.py"))
+
+SCANNERS = ("core", "adaptive", "sharded", "native")
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def percentiles(samples, points=(50, 90, 99)):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    result = {f"p{p}": round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] * 1000, 3) for p in points}
+    result["max"] = round(ordered[-1] * 1000, 3)
+    return result
+
+class LoopbackLab:
+    """Local listeners on many 127.x.y.z addresses with a seeded open/closed/black-holed mix.
+
+    Open ports accept and immediately close. Closed ports have no listener, so the
+    kernel answers with RST. Black-holed ports are listeners with a full accept
+    queue, which makes the kernel drop further SYNs until the probe times out.
+    """
+    def __init__(self, hosts=16, ports=100, base_port=41000, open_ratio=0.05,
+                 blackhole_ratio=0.01, network="127.77", seed=1337):
+        self.targets = [f"{network}.{i // 254}.{i % 254 + 1}" for i in range(hosts)]
+        self.ports = list(range(base_port, base_port + ports))
+        rng = random.Random(seed)
+        self.expected_open = set()
+        self.blackholed = set()
+        for ip in self.targets:
+            for port in self.ports:
+                roll = rng.random()
+                if roll < open_ratio:
+                    self.expected_open.add((ip, port))
+                elif roll < open_ratio + blackhole_ratio:
+                    self.blackholed.add((ip, port))
+        self._sockets = []
+        self._selector = selectors.DefaultSelector()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        for ip, port in self.expected_open:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((ip, port))
+            sock.listen(1024)
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ)
+            self._sockets.append(sock)
+        for ip, port in self.blackholed:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((ip, port))
+            sock.listen(0)
+            self._sockets.append(sock)
+            # Fill the accept queue; it is never drained
+            for _ in range(2):
+                filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                filler.setblocking(False)
+                filler.connect_ex((ip, port))
+                self._sockets.append(filler)
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+        time.sleep(0.1)
+        return self
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            for key, _ in self._selector.select(timeout=0.2):
+                try:
+                    conn, _ = key.fileobj.accept()
+                    conn.close()
+                except (BlockingIOError, OSError):
+                    pass
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._selector.close()
+        for sock in self._sockets:
+            sock.close()
+
+    @property
+    def probe_count(self):
+        return len(self.targets) * len(self.ports)
+
+def _load_native_scanner():
+    spec = importlib.util.spec_from_file_location("ghostscan_native_app", NATIVE_APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.AsyncScanner
+
+async def _run_backend(kind, targets, ports, concurrency, timeout, shards):
+    latencies = array("d")
+    found = []
+    controller = None
+    if kind == "sharded":
+        scanner = ShardedScanner(shards=shards, timeout=timeout, concurrency=concurrency)
+    else:
+        if kind == "adaptive":
+            controller = AdaptiveController(base_timeout=timeout, concurrency=min(64, concurrency))
+        scanner = AsyncScanner(timeout=timeout, concurrency=concurrency, controller=controller)
+        connect = scanner._connect
+
+        async def timed_connect(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await connect(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+        scanner._connect = timed_connect
+
+    async for ip, port, _ in scanner.scan_stream(targets, ports):
+        found.append((ip, port))
+    extra = {"controller": controller.snapshot(top=0)} if controller is not None else {}
+    return found, latencies, scanner.probes_done, extra
+
+async def _run_native(NativeScanner, targets, ports, concurrency, timeout):
+    scanner = NativeScanner(timeout=timeout, concurrency=concurrency)
+    latencies = array("d")
+    found = []
+    scan_port = scanner.scan_port
+
+    async def timed_scan_port(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await scan_port(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    scanner.scan_port = timed_scan_port
+
+    await scanner.scan_range(targets, ports, lambda ip, port: found.append((ip, port)))
+    return found, latencies, len(latencies), {}
+
+def run_scanner(kind, targets, ports, concurrency, timeout, shards):
+    """Runs one scanner in this (fresh) process and returns its metrics."""
+    raise_fd_limit()
+    logging.getLogger("scanner_core").setLevel(logging.WARNING)
+    logging.getLogger("sharding").setLevel(logging.WARNING)
+    if kind == "native":
+        try:
+            NativeScanner = _load_native_scanner()
+        except ImportError as e:
+            # The native scanner needs the GUI stack installed
+            return {"scanner": kind, "skipped": f"import failed: {e}"}
+        runner = _run_native(NativeScanner, targets, ports, concurrency, timeout)
+    else:
+        runner = _run_backend(kind, targets, ports, concurrency, timeout, shards)
+
+    start = time.perf_counter()
+    found, latencies, probes, extra = asyncio.run(runner)
+    duration = time.perf_counter() - start
+    return {
+        "scanner": kind,
+        "duration_s": round(duration, 4),
+        "probes": probes,
+        "probes_per_sec": round(probes / duration, 1) if duration else None,
+        "latency_ms": percentiles(latencies),
+        "peak_rss_kb": peak_rss_kb(),
+        "found": found,
+        **extra,
+    }
+
+def bench_persistence(rows=50000, batch_size=500):
+    """Pushes `rows` host + port upserts through the BatchWriter into a scratch database."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        # init_db prints to stdout, which carries the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            db.init_db(path)
+        writer = BatchWriter(path, batch_size=batch_size)
+        flushes = array("d")
+
+        def timed_commit(conn, batch, commit=writer._commit):
+            start = time.perf_counter()
+            commit(conn, batch)
+            if batch:
+                flushes.append(time.perf_counter() - start)
+        writer._commit = timed_commit
+
+        start = time.perf_counter()
+        for i in range(rows):
+            ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+            writer.submit(db.UPSERT_HOST, (ip, None, None, "bench"))
+            writer.submit(db.UPSERT_PORT, (ip, 80))
+        submitted = time.perf_counter() - start
+        writer.close()
+        duration = time.perf_counter() - start
+    return {
+        "rows": rows * 2,
+        "batch_size": batch_size,
+        "submit_s": round(submitted, 4),
+        "duration_s": round(duration, 4),
+        "rows_per_sec": round(rows * 2 / duration, 1),
+        "flushes": len(flushes),
+        "flush_latency_ms": percentiles(flushes),
+    }
+
+def run_benchmarks(args):
+    raise_fd_limit()
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with LoopbackLab(hosts=args.hosts, ports=args.ports, base_port=args.base_port,
+                     open_ratio=args.open_ratio, blackhole_ratio=args.blackhole_ratio,
+                     seed=args.seed) as lab:
+        for kind in args.scanners:
+            for run in range(args.repeat):
+                # Fresh process per run so peak RSS belongs to that scanner alone
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_scanner, kind, lab.targets, lab.ports,
+                                         args.concurrency, args.timeout, args.shards).result()
+                if "found" in result:
+                    found = set(map(tuple, result.pop("found")))
+                    result["correctness"] = {
+                        "expected_open": len(lab.expected_open),
+                        "found_open": len(found),
+                        "false_negatives": len(lab.expected_open - found),
+                        "false_positives": len(found - lab.expected_open),
+                    }
+                result["run"] = run
+                results.append(result)
+                if "skipped" in result:
+                    print(f"[bench] {kind} run {run}: skipped ({result['skipped']})", file=sys.stderr)
+                else:
+                    print(f"[bench] {kind} run {run}: {result['probes_per_sec']} probes/s", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {
+                "hosts": args.hosts, "ports": args.ports, "probes": args.hosts * args.ports,
+                "open_ratio": args.open_ratio, "blackhole_ratio": args.blackhole_ratio,
+                "concurrency": args.concurrency, "timeout": args.timeout,
+                "shards": args.shards, "seed": args.seed,
+            },
+        },
+        "scanners": results,
+    }
+    if args.db_rows:
+        report["persistence"] = bench_persistence(args.db_rows, args.db_batch)
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark GhostScan scanners against local loopback listeners.")
+    parser.add_argument("--hosts", type=int, default=16, help="loopback addresses to spread listeners over")
+    parser.add_argument("--ports", type=int, default=200, help="ports probed per host")
+    parser.add_argument("--base-port", type=int, default=41000)
+    parser.add_argument("--open-ratio", type=float, default=0.05)
+    parser.add_argument("--blackhole-ratio", type=float, default=0.005)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=0.5)
+    parser.add_argument("--shards", type=int, default=None, help="processes for the sharded scanner (default: CPU count)")
+    parser.add_argument("--scanners", nargs="+", choices=SCANNERS, default=["core", "adaptive", "sharded"])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1337)
+    parser.add_argument("--db-rows", type=int, default=20000, help="host upserts for the persistence benchmark (0 to skip)")
+    parser.add_argument("--db-batch", type=int, default=500)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    failures = sum(r.get("correctness", {}).get("false_negatives", 0) for r in report["scanners"])
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
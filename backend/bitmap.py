@@ -0,0 +1,256 @@
+import ipaddress
+import sys
+from array import array
+
+# One bit per TCP port 0-65535
+BITMAP_BYTES = 65536 // 8
+# Below this many ports a sorted uint16 list is smaller than the raw bitset
+SPARSE_LIMIT = BITMAP_BYTES // 2
+# Up to this many open ports a host keeps a plain set instead of allocating the bitset
+SET_LIMIT = 64
+
+# Bit offsets set in each byte value, so iteration only touches non-zero bytes
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+_V4_MAPPED = 0xFFFF << 32
+
+def pack_ip(ip):
+    """Address as an int in the IPv6 space (IPv4 mapped, as db.ip_key); hostnames stay strings."""
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    return _V4_MAPPED | int(addr) if addr.version == 4 else int(addr)
+
+def unpack_ip(key):
+    if isinstance(key, str):
+        return key
+    if key >> 32 == 0xFFFF:
+        return str(ipaddress.IPv4Address(key & 0xFFFFFFFF))
+    return str(ipaddress.IPv6Address(key))
+
+def _sort_key(key):
+    # Addresses in numeric order, hostnames after them
+    return (1, key) if isinstance(key, str) else (0, key)
+
+class PortBitmap:
+    """Open ports of one host: a small set while sparse, an 8 KiB bitset past SET_LIMIT ports.
+
+    Nothing is allocated until the first port is added, so the many hosts a
+    sweep finds nothing on cost only the object itself.
+    """
+    __slots__ = ("bits", "ports")
+
+    def __init__(self, ports=(), bits=None):
+        self.bits = bits  # bytearray once dense
+        self.ports = None  # set of ports while sparse
+        for port in ports:
+            self.add(port)
+
+    def add(self, port):
+        if self.bits is not None:
+            self.bits[port >> 3] |= 1 << (port & 7)
+        elif self.ports is None:
+            self.ports = {port}
+        else:
+            self.ports.add(port)
+            if len(self.ports) > SET_LIMIT:
+                self._densify()
+
+    def _densify(self):
+        bits = bytearray(BITMAP_BYTES)
+        for port in self.ports:
+            bits[port >> 3] |= 1 << (port & 7)
+        self.bits, self.ports = bits, None
+
+    def discard(self, port):
+        if self.bits is not None:
+            self.bits[port >> 3] &= ~(1 << (port & 7)) & 0xFF
+        elif self.ports is not None:
+            self.ports.discard(port)
+
+    def __contains__(self, port):
+        if self.bits is not None:
+            return 0 <= port < 65536 and bool(self.bits[port >> 3] >> (port & 7) & 1)
+        return self.ports is not None and port in self.ports
+
+    def __iter__(self):
+        if self.bits is None:
+            yield from sorted(self.ports or ())
+            return
+        for index, value in enumerate(self.bits):
+            if value:
+                base = index << 3
+                for bit in _BYTE_BITS[value]:
+                    yield base + bit
+
+    def __len__(self):
+        if self.bits is None:
+            return len(self.ports or ())
+        return self.as_int().bit_count()
+
+    def __bool__(self):
+        if self.bits is None:
+            return bool(self.ports)
+        return self.bits.count(0) != BITMAP_BYTES
+
+    def __eq__(self, other):
+        return isinstance(other, PortBitmap) and self.as_int() == other.as_int()
+
+    def __repr__(self):
+        return f"PortBitmap({list(self)})"
+
+    def copy(self):
+        if self.bits is not None:
+            return PortBitmap(bits=bytearray(self.bits))
+        return PortBitmap(self.ports or ())
+
+    # Set algebra runs on the whole bitset as one big int
+    def as_int(self):
+        if self.bits is None:
+            return sum(1 << port for port in self.ports or ())
+        return int.from_bytes(self.bits, "little")
+
+    @classmethod
+    def from_int(cls, value):
+        if value.bit_count() > SET_LIMIT:
+            return cls(bits=bytearray(value.to_bytes(BITMAP_BYTES, "little")))
+        ports = []
+        while value:
+            low = value & -value
+            ports.append(low.bit_length() - 1)
+            value ^= low
+        return cls(ports)
+
+    def __or__(self, other):
+        return PortBitmap.from_int(self.as_int() | other.as_int())
+
+    def __and__(self, other):
+        return PortBitmap.from_int(self.as_int() & other.as_int())
+
+    def __sub__(self, other):
+        return PortBitmap.from_int(self.as_int() & ~other.as_int())
+
+    def __xor__(self, other):
+        return PortBitmap.from_int(self.as_int() ^ other.as_int())
+
+    def to_blob(self):
+        """Sorted little-endian uint16 ports when sparse, otherwise the raw 8 KiB bitset.
+
+        The two are told apart by length alone: a sparse blob is always shorter
+        than BITMAP_BYTES.
+        """
+        if len(self) < SPARSE_LIMIT:
+            ports = array("H", self)
+            if sys.byteorder == "big":
+                ports.byteswap()
+            return ports.tobytes()
+        return bytes(self.bits)
+
+    @classmethod
+    def from_blob(cls, blob):
+        if len(blob) == BITMAP_BYTES:
+            return cls(bits=bytearray(blob))
+        if len(blob) % 2:
+            raise ValueError("Malformed port bitmap blob")
+        ports = array("H")
+        ports.frombytes(blob)
+        if sys.byteorder == "big":
+            ports.byteswap()
+        return cls(ports)
+
+class ScanResults:
+    """Per-host PortBitmaps keyed by packed address; the compact form of scan_range's findings.
+
+    Hosts scanned with nothing open are kept with an empty, unallocated bitmap.
+    The set operators work host by host across two result sets (e.g. two
+    scans); intersection and difference drop hosts left with no ports.
+    """
+    def __init__(self):
+        self.hosts = {}  # pack_ip(ip) -> PortBitmap
+
+    def add_host(self, ip):
+        key = pack_ip(ip)
+        bitmap = self.hosts.get(key)
+        if bitmap is None:
+            bitmap = self.hosts[key] = PortBitmap()
+        return bitmap
+
+    def add(self, ip, port):
+        self.add_host(ip).add(port)
+
+    def get(self, ip):
+        return self.hosts.get(pack_ip(ip))
+
+    def __contains__(self, ip):
+        return pack_ip(ip) in self.hosts
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def items(self):
+        """(ip, PortBitmap) pairs, addresses in numeric order."""
+        for key in sorted(self.hosts, key=_sort_key):
+            yield unpack_ip(key), self.hosts[key]
+
+    @property
+    def open_count(self):
+        return sum(len(bitmap) for bitmap in self.hosts.values())
+
+    def _combine(self, other, op, keys, keep_empty):
+        result = ScanResults()
+        for key in keys:
+            mine, theirs = self.hosts.get(key), other.hosts.get(key)
+            if mine is None or theirs is None:
+                # Only union and difference get here; the present side passes through as is
+                bitmap = (theirs if mine is None else mine).copy()
+            else:
+                bitmap = op(mine, theirs)
+            if keep_empty or bitmap:
+                result.hosts[key] = bitmap
+        return result
+
+    def union(self, other):
+        return self._combine(other, PortBitmap.__or__, self.hosts.keys() | other.hosts.keys(), True)
+
+    def intersection(self, other):
+        return self._combine(other, PortBitmap.__and__, self.hosts.keys() & other.hosts.keys(), False)
+
+    def difference(self, other):
+        return self._combine(other, PortBitmap.__sub__, self.hosts.keys(), False)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def select(self, has=(), lacks=()):
+        """Hosts with every port in `has` open and none of `lacks`, e.g. select([22], [443])."""
+        has, lacks = tuple(has), tuple(lacks)
+        result = ScanResults()
+        for key, bitmap in self.hosts.items():
+            if all(port in bitmap for port in has) and not any(port in bitmap for port in lacks):
+                result.hosts[key] = bitmap
+        return result
+
+    def to_dict(self):
+        """The legacy {ip: sorted open ports} shape."""
+        return {ip: list(bitmap) for ip, bitmap in self.items()}
+
+    @classmethod
+    def from_dict(cls, findings):
+        results = cls()
+        for ip, ports in findings.items():
+            bitmap = results.add_host(ip)
+            for port in ports:
+                bitmap.add(port)
+        return results
+
+    def to_rows(self):
+        """(ip, blob) pairs for the scan_results table."""
+        return [(ip, bitmap.to_blob()) for ip, bitmap in self.items()]
+
+    @classmethod
+    def from_rows(cls, rows):
+        results = cls()
+        for ip, blob in rows:
+            results.hosts[pack_ip(ip)] = PortBitmap.from_blob(blob)
+        return results
@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import contextlib
+import ipaddress
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from scanner_core import AsyncScanner, ProbeCursor, expand_ports, expand_targets
+from resolver import is_address
+
+# Web, GUI and DB modules are imported where they are first used, so a plain
+# scan starts without loading FastAPI, Tk or the DB layer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "ghostscan.db")
+NATIVE_APP = os.path.abspath(os.path.join(BASE_DIR, "..", "native", "app.py"))
+
+# Targets read and resolved together; the reader thread queues up to this many more meanwhile
+TARGET_BATCH = 256
+
+logger = logging.getLogger(__name__)
+
+def read_targets(sources):
+    """Yields targets from files ("-" is stdin) as lines arrive.
+
+    A line holds one or more targets separated by commas or whitespace; "#"
+    starts a comment.
+    """
+    for source in sources:
+        f = sys.stdin if source == "-" else open(source)
+        try:
+            for line in f:
+                yield from line.split("#", 1)[0].replace(",", " ").split()
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+_END = object()
+
+async def target_batches(targets, size=TARGET_BATCH):
+    """Groups a blocking target iterator into batches of up to `size`.
+
+    A reader thread feeds a bounded queue, so a slow producer on stdin gets
+    each target scanned as soon as it arrives instead of after a full batch,
+    and a fast one is held back while the scan catches up.
+    """
+    pending = queue.Queue(maxsize=size)
+
+    def feed():
+        try:
+            for target in targets:
+                pending.put(target)
+        except Exception as e:
+            pending.put(e)
+        pending.put(_END)
+
+    threading.Thread(target=feed, name="ghostscan-targets", daemon=True).start()
+    while True:
+        batch = [await asyncio.to_thread(pending.get)]
+        while len(batch) < size:
+            try:
+                batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        for item in batch:
+            if isinstance(item, Exception):
+                raise item
+        if batch[-1] is _END:
+            batch.pop()
+            if batch:
+                yield batch
+            return
+        yield batch
+
+class TargetFeed:
+    """Hosts for one streaming ProbeCursor, added as the reader resolves them.
+
+    Each address is scanned at most once per run: addresses already queued,
+    or inside a CIDR already queued, are dropped, and a CIDR skips the hosts
+    it shares with earlier ones. CIDRs are expanded lazily as the cursor
+    reaches them. Iterating yields hosts, or None while nothing is ready yet.
+    """
+    def __init__(self):
+        self.hostnames = {}  # ip -> names that resolved to it
+        self.closed = False  # no more targets will be added
+        self.exhausted = False  # closed, and every host has been handed out
+        self._targets = deque()  # (target, earlier CIDRs it overlaps) waiting to be expanded
+        self._hosts = iter(())
+        self._seen = set()  # single addresses queued so far
+        self._networks = []  # CIDRs queued so far
+        self._ready = asyncio.Event()
+
+    def add(self, targets, hostnames=None):
+        for ip, names in (hostnames or {}).items():
+            known = self.hostnames.setdefault(ip, [])
+            known.extend(name for name in names if name not in known)
+        for target in targets:
+            if "/" in target:
+                net = ipaddress.ip_network(target, strict=False)
+                earlier = [prior for prior in self._networks if prior.version == net.version and prior.overlaps(net)]
+                if any(net.subnet_of(prior) for prior in earlier):
+                    continue
+                self._networks.append(net)
+                self._targets.append((target, earlier))
+            else:
+                addr = ipaddress.ip_address(target)
+                if target in self._seen or any(addr in net for net in self._networks):
+                    continue
+                self._seen.add(target)
+                self._targets.append((target, ()))
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def wait(self):
+        """Returns once targets were added or the feed was closed."""
+        await self._ready.wait()
+        self._ready.clear()
+
+    def _expand(self, target, earlier):
+        if "/" not in target:
+            yield target
+            return
+        for ip in expand_targets([target]):
+            if ip in self._seen or (earlier and any(ipaddress.ip_address(ip) in net for net in earlier)):
+                continue
+            yield ip
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            ip = next(self._hosts, None)
+            if ip is not None:
+                return ip
+            if not self._targets:
+                if self.closed:
+                    self.exhausted = True
+                    raise StopIteration
+                return None
+            self._hosts = self._expand(*self._targets.popleft())
+
+async def feed_targets(args, feed):
+    """Reads, resolves and queues targets until the input ends, then closes the feed."""
+    resolver = None
+    try:
+        async for batch in target_batches(read_targets(args.targets)):
+            targets, hostnames, unresolved = batch, {}, []
+            if not all(is_address(target) for target in batch):
+                if args.no_resolve:
+                    targets = [target for target in batch if is_address(target)]
+                    unresolved = [target for target in batch if not is_address(target)]
+                else:
+                    if resolver is None:
+                        from resolver import Resolver
+                        resolver = Resolver()
+                    targets, hostnames, unresolved = await resolver.expand(batch)
+            for name in unresolved:
+                logger.warning(f"Skipping {name}: not an address, or did not resolve")
+            feed.add(targets, hostnames)
+    finally:
+        feed.close()
+
+class Sink:
+    """Writes findings as NDJSON lines, and to the DB through a BatchWriter when given one."""
+    def __init__(self, out, writer=None):
+        self.out = out
+        self.writer = writer
+        self.hosts = set()
+        self.services = {}  # ip -> [classified service], for the final host upsert
+        self.open_count = 0
+
+    async def emit(self, ip, port, is_open, hostnames=None, service=None):
+        record = {"ip": ip, "port": port, "open": is_open, "time": round(time.time(), 3)}
+        if hostnames:
+            record["hostnames"] = hostnames
+        if service:
+            record.update((key, value) for key, value in service.items() if key != "port")
+        self.out.write(json.dumps(record, separators=(",", ":")) + "\n")
+        # Line by line, so pipelines see findings as they occur
+        self.out.flush()
+        if not is_open:
+            return
+        self.open_count += 1
+        if service:
+            self.services.setdefault(ip, []).append(service)
+        if self.writer is not None:
+            from db import UPSERT_HOST, UPSERT_PORT
+            if ip not in self.hosts:
+                self.hosts.add(ip)
+                await self.writer.submit_async(UPSERT_HOST, (ip, None, None, "cli"))
+            await self.writer.submit_async(UPSERT_PORT, (ip, port))
+
+    async def close(self):
+        if self.writer is None:
+            return
+        from db import UPSERT_HOST
+        for ip, services in self.services.items():
+            services = sorted(services, key=lambda s: s["port"])
+            await self.writer.submit_async(UPSERT_HOST, (ip, json.dumps(services), None, "cli"))
+        await asyncio.to_thread(self.writer.close)
+
+async def run_scan(args, ports, out=sys.stdout):
+    scanner = AsyncScanner(timeout=args.timeout, concurrency=args.concurrency, banners=args.banners,
+                           per_host=args.per_host)
+    writer = None
+    if args.db:
+        from db import init_db
+        from persistence import BatchWriter
+        # init_db reports on stdout, which carries the findings here
+        with contextlib.redirect_stdout(sys.stderr):
+            init_db(args.db)
+        writer = BatchWriter(args.db)
+    sink = Sink(out, writer)
+    feed = TargetFeed()
+    # One cursor for the whole run, so the window stays full as new targets arrive
+    probes = ProbeCursor(None, ports, per_host=scanner.per_host, hosts=feed)
+    reader = asyncio.create_task(feed_targets(args, feed))
+    start = time.monotonic()
+    try:
+        while True:
+            async for ip, port, is_open in scanner.scan_probes(probes, open_only=not args.closed):
+                service = scanner.services.pop((ip, port), None)
+                await sink.emit(ip, port, is_open, feed.hostnames.get(ip), service)
+            if feed.exhausted:
+                break
+            # Everything queued so far is done; wait for the reader to add more
+            await feed.wait()
+        await reader
+    finally:
+        reader.cancel()
+        await sink.close()
+    logger.info(f"{scanner.probes_done} probes, {sink.open_count} open in {time.monotonic() - start:.2f}s")
+    return 0
+
+def scan_main(args, parser):
+    try:
+        ports = list(dict.fromkeys(expand_ports(args.ports)))
+    except ValueError as e:
+        parser.error(f"bad port spec: {e}")
+    if not ports or not all(0 < port < 65536 for port in ports):
+        parser.error("ports must be between 1 and 65535")
+    if not args.targets:
+        args.targets = ["-"]
+    for source in args.targets:
+        if source == "-":
+            continue
+        try:
+            open(source).close()
+        except OSError as e:
+            parser.error(f"can't read {source}: {e.strerror}")
+    try:
+        return asyncio.run(run_scan(args, ports))
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # The reader went away (e.g. `| head`); don't complain on the closed stdout
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+
+def serve_main(args, parser):
+    import uvicorn
+    from api import app
+    uvicorn.run(app, host=args.host, port=args.port)
+    return 0
+
+def gui_main(args, parser):
+    import runpy
+    runpy.run_path(NATIVE_APP, run_name="__main__")
+    return 0
+
+def export_main(args, parser):
+    from export import main
+    return main(args.export_args)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ghostscan", description="GhostScan from the command line.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every open port and progress to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="scan targets and stream findings to stdout as NDJSON")
+    scan.add_argument("targets", nargs="*", metavar="FILE",
+                      help="files of IPs, CIDRs and hostnames, one or more per line; - or none reads stdin")
+    scan.add_argument("-p", "--ports", default="top100", help="e.g. 1-1024,3306,top100 (default: top100)")
+    scan.add_argument("--timeout", type=float, default=0.5)
+    scan.add_argument("--concurrency", type=int, default=500)
+    scan.add_argument("--per-host", type=int, help="probes in flight per host")
+    scan.add_argument("--banners", action="store_true", help="grab and classify service banners")
+    scan.add_argument("--closed", action="store_true", help="also emit closed and filtered ports")
+    scan.add_argument("--no-resolve", action="store_true", help="skip hostnames instead of resolving them")
+    scan.add_argument("--db", nargs="?", const=DB_PATH,
+                      help=f"also record open ports in this database (default: {DB_PATH})")
+    scan.set_defaults(handler=scan_main)
+
+    serve = commands.add_parser("serve", help="run the HTTP API")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8002)
+    serve.set_defaults(handler=serve_main)
+
+    gui = commands.add_parser("gui", help="open the desktop app")
+    gui.set_defaults(handler=gui_main)
+
+    # Its options belong to export.main; main() hands them over unparsed
+    export = commands.add_parser("export", help="stream stored devices out as NDJSON or CSV", add_help=False)
+    export.set_defaults(handler=export_main)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "export":
+        args.export_args = [arg for arg in extra if arg != "--"]
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    # scanner_core logs every finding at INFO; stdout already carries them
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    return args.handler(args, parser)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,328 @@
+import base64
+import ipaddress
+import json
 import sqlite3
 import os
+from datetime import datetime, timezone
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "ghostscan.db")
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Devices table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip TEXT NOT NULL,
-            ports TEXT, -- Comma-separated list of ports
-            services TEXT, -- JSON-like string of service info
-            location TEXT, -- Country/City
-            last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
-            source TEXT -- "scanner" or "api"
-        )
-    ''')
-    
-    # Intelligence Cache (e.g. Shodan results)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS intel_cache (
-            ip TEXT PRIMARY KEY,
-            data TEXT, -- Full JSON dump
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print(f"GhostScan Database initialized at {DB_PATH}")
+# One row per host, one row per (host, port); both upserted on rescans
+UPSERT_HOST = '''
+    INSERT INTO hosts (ip, ip_key, services, location, source, last_seen)
+    VALUES (?1, ip_key(?1), ?2, ?3, ?4, CURRENT_TIMESTAMP)
+    ON CONFLICT(ip) DO UPDATE SET
+        services = COALESCE(excluded.services, hosts.services),
+        location = COALESCE(excluded.location, hosts.location),
+        source = COALESCE(excluded.source, hosts.source),
+        last_seen = excluded.last_seen
+'''
+
+UPSERT_PORT = '''
+    INSERT INTO host_ports (ip, port, last_seen)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(ip, port) DO UPDATE SET last_seen = excluded.last_seen
+'''
+
+DELETE_PORT = "DELETE FROM host_ports WHERE ip = ? AND port = ?"
+
+# Incremental rescans: last outcome per (host, port); times are unix epoch seconds.
+# last_changed only moves when the state does.
+UPSERT_PORT_STATE = '''
+    INSERT INTO port_state (ip, port, state, last_checked, last_changed)
+    VALUES (?1, ?2, ?3, ?4, ?4)
+    ON CONFLICT(ip, port) DO UPDATE SET
+        last_changed = CASE WHEN port_state.state = excluded.state
+            THEN port_state.last_changed ELSE excluded.last_checked END,
+        state = excluded.state,
+        last_checked = excluded.last_checked
+'''
+
+INSERT_CHANGE = '''
+    INSERT INTO port_changes (ip, port, change, job_id, at)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
+# Per-job snapshot of what was found open; ports is a bitmap.PortBitmap blob
+INSERT_SCAN_RESULT = '''
+    INSERT OR REPLACE INTO scan_results (job_id, ip, ports)
+    VALUES (?, ?, ?)
+'''
+SELECT_SCAN_RESULTS = "SELECT ip, ports FROM scan_results WHERE job_id = ?"
+
+# Scan jobs survive restarts: spec is the job's JSON constructor arguments, position
+# its last ProbeCursor checkpoint
+INSERT_SCAN_JOB = '''
+    INSERT OR IGNORE INTO scan_jobs (id, spec, status, created_at, updated_at)
+    VALUES (?1, ?2, ?3, ?4, ?4)
+'''
+UPDATE_SCAN_JOB_STATUS = "UPDATE scan_jobs SET status = ?, updated_at = ? WHERE id = ?"
+UPDATE_SCAN_JOB_CHECKPOINT = '''
+    UPDATE scan_jobs SET position = ?, open_found = ?, updated_at = ? WHERE id = ?
+'''
+SELECT_RESUMABLE_JOBS = '''
+    SELECT id, spec, position, open_found FROM scan_jobs
+    WHERE status IN ('queued', 'running', 'interrupted') ORDER BY created_at
+'''
+
+# Hosts with their open ports folded back into the legacy comma-separated shape
+SELECT_DEVICES = '''
+    SELECT h.id, h.ip,
+        (SELECT group_concat(port, ',') FROM
+            (SELECT port FROM host_ports p WHERE p.ip = h.ip ORDER BY port)) AS ports,
+        h.services, h.location, h.last_seen, h.source
+    FROM hosts h
+'''
+DEVICE_COLUMNS = ("id", "ip", "ports", "services", "location", "last_seen", "source")
+
+def ip_key(ip):
+    """Byte-sortable 16-byte key for an address (IPv4 mapped into IPv6); None for hostnames."""
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if addr.version == 4:
+        return b"\0" * 10 + b"\xff\xff" + addr.packed
+    return addr.packed
+
+def register_functions(conn):
+    """SQL functions the statements above rely on; every connection that writes hosts needs them."""
+    conn.create_function("ip_key", 1, ip_key, deterministic=True)
+
+def encode_cursor(last_seen, host_id):
+    return base64.urlsafe_b64encode(json.dumps([last_seen, host_id]).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        last_seen, host_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Malformed cursor")
+    return last_seen, int(host_id)
+
+def normalize_time(value):
+    """Accepts ISO 8601 or SQLite timestamps; returns SQLite's CURRENT_TIMESTAMP text format (UTC)."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00").replace(" ", "T"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+def device_filters(port=None, cidr=None, source=None, since=None, until=None):
+    """WHERE clauses and parameters shared by the device page and export queries.
+
+    Raises ValueError for a malformed CIDR or timestamp.
+    """
+    where, params = [], []
+    if port is not None:
+        # Lets the planner start from idx_host_ports_port when the port is rare
+        where.append("h.ip IN (SELECT ip FROM host_ports WHERE port = ?)")
+        params.append(port)
+    if cidr:
+        net = ipaddress.ip_network(cidr, strict=False)
+        where.append("h.ip_key BETWEEN ? AND ?")
+        params += [ip_key(str(net.network_address)), ip_key(str(net.broadcast_address))]
+    if source:
+        where.append("h.source = ?")
+        params.append(source)
+    if since:
+        where.append("h.last_seen >= ?")
+        params.append(normalize_time(since))
+    if until:
+        where.append("h.last_seen < ?")
+        params.append(normalize_time(until))
+    return where, params
+
+def select_devices(conn, limit=100, cursor=None, **filters):
+    """One page of devices, newest last_seen first, keyset-paginated on (last_seen, id).
+
+    `filters` are device_filters() keywords. Returns (rows as tuples in
+    DEVICE_COLUMNS order, cursor for the next page or None).
+    Raises ValueError for a malformed cursor, CIDR or timestamp.
+    """
+    where, params = device_filters(**filters)
+    if cursor:
+        last_seen, host_id = decode_cursor(cursor)
+        where.append("(h.last_seen, h.id) < (?, ?)")
+        params += [last_seen, host_id]
+
+    sql = SELECT_DEVICES
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY h.last_seen DESC, h.id DESC LIMIT ?"
+    # One extra row tells whether there is a next page
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[5], last[0])
+    return rows, next_cursor
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS hosts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ip TEXT NOT NULL UNIQUE,
+        ip_key BLOB, -- ip_key(ip), for CIDR range lookups
+        services TEXT, -- JSON-like string of service info
+        location TEXT, -- Country/City
+        source TEXT, -- "scanner", "native" or "api"
+        first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_seen DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_hosts_last_seen ON hosts (last_seen);
+
+    CREATE TABLE IF NOT EXISTS host_ports (
+        ip TEXT NOT NULL,
+        port INTEGER NOT NULL,
+        first_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        last_seen DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (ip, port)
+    );
+    CREATE INDEX IF NOT EXISTS idx_host_ports_port ON host_ports (port);
+    CREATE INDEX IF NOT EXISTS idx_host_ports_last_seen ON host_ports (last_seen);
+
+    -- Row counts maintained by triggers so /status never scans a table
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+    -- 'version' moves on every hosts/host_ports write; /devices derives its ETag from it
+    INSERT OR IGNORE INTO counters (name, value) VALUES ('hosts', 0), ('ports', 0), ('version', 0);
+
+    CREATE TRIGGER IF NOT EXISTS trg_hosts_insert AFTER INSERT ON hosts
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'hosts'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_hosts_delete AFTER DELETE ON hosts
+    BEGIN UPDATE counters SET value = value - 1 WHERE name = 'hosts'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_ports_insert AFTER INSERT ON host_ports
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'ports'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_ports_delete AFTER DELETE ON host_ports
+    BEGIN UPDATE counters SET value = value - 1 WHERE name = 'ports'; END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_hosts_version_insert AFTER INSERT ON hosts
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'version'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_hosts_version_update AFTER UPDATE ON hosts
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'version'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_hosts_version_delete AFTER DELETE ON hosts
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'version'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_ports_version_insert AFTER INSERT ON host_ports
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'version'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_ports_version_update AFTER UPDATE ON host_ports
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'version'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_ports_version_delete AFTER DELETE ON host_ports
+    BEGIN UPDATE counters SET value = value + 1 WHERE name = 'version'; END;
+
+    -- Per (host, port) outcome of the last probe: open, closed (refused) or filtered (no answer)
+    CREATE TABLE IF NOT EXISTS port_state (
+        ip TEXT NOT NULL,
+        port INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        last_checked REAL NOT NULL,
+        last_changed REAL NOT NULL,
+        PRIMARY KEY (ip, port)
+    ) WITHOUT ROWID;
+
+    -- Diffs found by incremental rescans: opened, closed, vanished (port is NULL)
+    CREATE TABLE IF NOT EXISTS port_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ip TEXT NOT NULL,
+        port INTEGER,
+        change TEXT NOT NULL,
+        job_id TEXT,
+        at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_port_changes_ip ON port_changes (ip);
+
+    -- Open ports per host as found by one scan job, for set operations across scans
+    CREATE TABLE IF NOT EXISTS scan_results (
+        job_id TEXT NOT NULL,
+        ip TEXT NOT NULL,
+        ports BLOB NOT NULL, -- sorted uint16 ports, or the raw 8 KiB bitset when dense
+        PRIMARY KEY (job_id, ip)
+    ) WITHOUT ROWID;
+
+    -- Jobs left queued, running or interrupted are resumed when the API starts
+    CREATE TABLE IF NOT EXISTS scan_jobs (
+        id TEXT PRIMARY KEY,
+        spec TEXT NOT NULL,
+        status TEXT NOT NULL,
+        position TEXT, -- JSON scanner_core.ProbeCursor.position of the last checkpoint
+        open_found INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+
+    -- Intelligence Cache (e.g. Shodan results)
+    CREATE TABLE IF NOT EXISTS intel_cache (
+        ip TEXT PRIMARY KEY,
+        data TEXT, -- Full JSON dump
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+# Run after the hosts.ip_key column is guaranteed to exist
+INDEXES = '''
+    CREATE INDEX IF NOT EXISTS idx_hosts_ip_key ON hosts (ip_key);
+    CREATE INDEX IF NOT EXISTS idx_hosts_source_last_seen ON hosts (source, last_seen);
+'''
+
+def migrate_legacy_devices(conn):
+    """Folds the old append-only `devices` table (ports as CSV text) into hosts/host_ports.
+
+    Handles both the backend layout and the native app's (no services/source columns).
+    Returns the number of legacy rows migrated.
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "devices" not in tables:
+        return 0
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(devices)")}
+    services = "services" if "services" in columns else "NULL"
+    source = "source" if "source" in columns else "NULL"
+
+    rows = conn.execute(f'''
+        SELECT ip, ports, {services}, location, {source}, last_seen
+        FROM devices ORDER BY last_seen, id
+    ''').fetchall()
+
+    for ip, ports, services_val, location, source_val, last_seen in rows:
+        # Rows are replayed oldest first so the newest values win
+        conn.execute('''
+            INSERT INTO hosts (ip, ip_key, services, location, source, first_seen, last_seen)
+            VALUES (?1, ip_key(?1), ?2, ?3, ?4, ?5, ?6)
+            ON CONFLICT(ip) DO UPDATE SET
+                services = COALESCE(excluded.services, hosts.services),
+                location = COALESCE(excluded.location, hosts.location),
+                source = COALESCE(excluded.source, hosts.source),
+                last_seen = MAX(hosts.last_seen, excluded.last_seen)
+        ''', (ip, services_val, location, source_val, last_seen, last_seen))
+        for port in (ports or "").split(","):
+            if port.strip().isdigit():
+                conn.execute('''
+                    INSERT INTO host_ports (ip, port, first_seen, last_seen)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(ip, port) DO UPDATE SET
+                        last_seen = MAX(host_ports.last_seen, excluded.last_seen)
+                ''', (ip, int(port), last_seen, last_seen))
+
+    conn.execute("DROP TABLE devices")
+    return len(rows)
+
+def init_db(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path)
+    register_functions(conn)
+    try:
+        conn.executescript(SCHEMA)
+        if "ip_key" not in {row[1] for row in conn.execute("PRAGMA table_info(hosts)")}:
+            conn.execute("ALTER TABLE hosts ADD COLUMN ip_key BLOB")
+        conn.executescript(INDEXES)
+        with conn:
+            conn.execute("BEGIN")
+            migrated = migrate_legacy_devices(conn)
+            # Rows written before ip_key existed
+            conn.execute("UPDATE hosts SET ip_key = ip_key(ip) WHERE ip_key IS NULL")
+    finally:
+        conn.close()
+    if migrated:
+        print(f"Migrated {migrated} legacy device rows")
+    print(f"GhostScan Database initialized at {db_path}")
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,84 @@
+import asyncio
+import itertools
+import json
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class EventBus:
+    """In-process fan-out of live events with a bounded replay history.
+
+    Every event gets a monotonically increasing sequence number that doubles as
+    the resume cursor: a subscriber reconnecting with cursor N receives only the
+    events after N. If N has already fallen out of the history, it gets a single
+    "reset" event and should reload its state from the REST endpoints.
+    """
+    def __init__(self, history=2048):
+        self.seq = 0
+        self.history = deque(maxlen=history)
+        self._changed = asyncio.Event()
+        self._loop = None
+
+    def bind(self, loop):
+        """Remembers the loop that owns the bus so other threads can publish."""
+        self._loop = loop
+
+    def publish(self, kind, data):
+        """Appends an event and wakes subscribers. Must run on the bus's loop."""
+        self.seq += 1
+        self.history.append((self.seq, kind, data))
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+        return self.seq
+
+    def call_threadsafe(self, callback, *args):
+        """Schedules callback(*args) on the bus's loop from any thread."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def publish_threadsafe(self, kind, data):
+        self.call_threadsafe(self.publish, kind, data)
+
+    def _since(self, cursor):
+        if cursor > self.seq:
+            # Cursor from before a restart
+            return None
+        if not self.history or cursor == self.seq:
+            return []
+        oldest = self.history[0][0]
+        if cursor < oldest - 1:
+            return None
+        # Sequence numbers are contiguous, so the offset into the deque is exact
+        return list(itertools.islice(self.history, cursor - oldest + 1, None))
+
+    async def subscribe(self, cursor=None, heartbeat=15.0):
+        """Yields (seq, kind, data) after `cursor`; yields None as a keep-alive tick."""
+        if cursor is None:
+            cursor = self.seq
+        while True:
+            changed = self._changed
+            events = self._since(cursor)
+            if events is None:
+                cursor = self.seq
+                yield cursor, "reset", {"cursor": cursor}
+                continue
+            if events:
+                for event in events:
+                    yield event
+                cursor = events[-1][0]
+                continue
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+def format_sse(event):
+    """Renders one subscribe() item as a text/event-stream frame."""
+    if event is None:
+        return ": keep-alive\n\n"
+    seq, kind, data = event
+    # Frames without an id (seq=None) don't move the client's resume cursor
+    frame = f"id: {seq}\n" if seq is not None else ""
+    return frame + f"event: {kind}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
@@ -0,0 +1,145 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import zlib
+from db import SELECT_DEVICES, DEVICE_COLUMNS, device_filters, encode_cursor, decode_cursor
+from persistence import connect
+
+try:
+    import orjson  # optional; much faster row encoding
+except ImportError:
+    orjson = None
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "ghostscan.db")
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+# Rows per fetchmany() and per emitted chunk
+BATCH_SIZE = 1000
+# Rows whose last_seen is this recent may still have uncommitted siblings; they wait for the next export
+SETTLE_SECONDS = 2
+
+def open_export(db_path=DB_PATH, after=None, **filters):
+    """Opens a read snapshot of the devices matching `filters`, oldest last_seen first.
+
+    `after` is a cursor from a previous export; only rows written since are
+    returned. Returns (conn, row cursor, cursor for the next incremental export).
+    The connection holds a WAL read transaction, so scan writes carry on while
+    rows stream out; close it when done. Rows touched in the last SETTLE_SECONDS
+    are left to the next export so the returned cursor never skips a row.
+    Raises ValueError for a malformed cursor, CIDR or timestamp.
+    """
+    where, params = device_filters(**filters)
+    if after:
+        last_seen, host_id = decode_cursor(after)
+        where.append("(h.last_seen, h.id) > (?, ?)")
+        params += [last_seen, host_id]
+    where.append("h.last_seen < ?")
+    params.append(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - SETTLE_SECONDS)))
+    clause = " WHERE " + " AND ".join(where)
+
+    # Handed to a streaming response, so it may be read from another thread
+    conn = connect(db_path, check_same_thread=False)
+    try:
+        conn.execute("BEGIN")
+        # Same snapshot as the rows below, so the cursor matches the last row streamed
+        last = conn.execute(
+            f"SELECT h.last_seen, h.id FROM hosts h{clause} ORDER BY h.last_seen DESC, h.id DESC LIMIT 1",
+            params).fetchone()
+        rows = conn.execute(f"{SELECT_DEVICES}{clause} ORDER BY h.last_seen, h.id", params)
+    except Exception:
+        conn.close()
+        raise
+    next_cursor = encode_cursor(*last) if last else after
+    return conn, rows, next_cursor
+
+def _ndjson(batch):
+    if orjson is not None:
+        return b"".join(orjson.dumps(dict(zip(DEVICE_COLUMNS, row))) + b"\n" for row in batch)
+    return "".join(json.dumps(dict(zip(DEVICE_COLUMNS, row)), separators=(",", ":")) + "\n"
+                   for row in batch).encode()
+
+def _csv(batch):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows(batch)
+    return buf.getvalue().encode()
+
+def encode_rows(conn, rows, fmt="ndjson", batch_size=BATCH_SIZE):
+    """Yields the rows as encoded chunks, one per batch, and closes `conn` at the end."""
+    encode = _csv if fmt == "csv" else _ndjson
+    try:
+        if fmt == "csv":
+            yield _csv([DEVICE_COLUMNS])
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            yield encode(batch)
+    finally:
+        conn.close()
+
+def gzip_chunks(chunks, level=6):
+    """Compresses a chunk stream into one gzip member without buffering it."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Closes the source (and its DB connection) if the consumer stops early
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream GhostScan devices out as NDJSON or CSV.")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--output", help="file to write (default: stdout)")
+    parser.add_argument("--gzip", action="store_true", help="gzip-compress the output")
+    parser.add_argument("--after", help="cursor from a previous export; only rows changed since")
+    parser.add_argument("--cursor-file", help="read --after from this file and store the next cursor in it")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--cidr")
+    parser.add_argument("--source")
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    args = parser.parse_args(argv)
+
+    after = args.after
+    if after is None and args.cursor_file and os.path.exists(args.cursor_file):
+        with open(args.cursor_file) as f:
+            after = f.read().strip() or None
+    try:
+        conn, rows, next_cursor = open_export(args.db, after=after, port=args.port, cidr=args.cidr,
+                                              source=args.source, since=args.since, until=args.until)
+    except ValueError as e:
+        parser.error(str(e))
+
+    chunks = encode_rows(conn, rows, args.format)
+    if args.gzip:
+        chunks = gzip_chunks(chunks)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+
+    if next_cursor:
+        if args.cursor_file:
+            with open(args.cursor_file, "w") as f:
+                f.write(next_cursor + "\n")
+        print(f"next cursor: {next_cursor}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
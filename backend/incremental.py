@@ -0,0 +1,207 @@
+import heapq
+import logging
+import time
+from collections import deque
+from scanner_core import expand_targets, expand_ports, count_probes
+from persistence import connect
+
+logger = logging.getLogger(__name__)
+
+# Entries whose state changed within RECENT_WINDOW look this many times staler
+CHANGE_BOOST = 4.0
+RECENT_WINDOW = 24 * 3600
+# Hosts per port_state lookup
+CHUNK_SIZE = 500
+
+# Probe outcome -> stored state; resource errors say nothing about the target
+STATES = {"open": "open", "refused": "closed", "timeout": "filtered", "error": "filtered"}
+
+def priority(row, now, recent_window=RECENT_WINDOW):
+    """Higher means probe sooner: never checked first, then stalest, with recent changes boosted."""
+    if row is None:
+        return float("inf")
+    _, last_checked, last_changed = row
+    staleness = now - last_checked
+    if now - last_changed < recent_window:
+        staleness *= CHANGE_BOOST
+    return staleness
+
+def _load_states(conn, ips):
+    """(ip, port) -> (state, last_checked, last_changed) for the hosts in `ips`.
+
+    Ports only host_ports knows about (found by normal scans, never rescanned)
+    count as open, last checked when they were last seen.
+    """
+    placeholders = ",".join("?" * len(ips))
+    rows = conn.execute(
+        f"SELECT ip, port, state, last_checked, last_changed FROM port_state WHERE ip IN ({placeholders})", ips)
+    states = {(ip, port): (state, last_checked, last_changed) for ip, port, state, last_checked, last_changed in rows}
+    rows = conn.execute(
+        f"SELECT ip, port, CAST(strftime('%s', last_seen) AS REAL) FROM host_ports WHERE ip IN ({placeholders})", ips)
+    for ip, port, last_seen in rows:
+        states.setdefault((ip, port), ("open", last_seen or 0.0, 0.0))
+    return states
+
+def plan_rescan(db_path, targets, ports, budget=None, min_age=0.0, recent_window=RECENT_WINDOW, now=None):
+    """Chooses which (host, port) pairs to probe and returns a RescanSource for them.
+
+    Pairs checked less than `min_age` seconds ago are skipped; of the rest, the
+    `budget` with the highest priority() are kept. Without a budget every pair
+    is probed, so nothing is ranked: the source streams them host by host,
+    reading state for CHUNK_SIZE hosts at a time as it goes. Blocking: call it
+    off the event loop.
+    """
+    now = time.time() if now is None else now
+    port_list = list(dict.fromkeys(expand_ports(ports)))
+    known_open = {}  # ip -> ports recorded open, probed or not
+
+    def candidates(conn, skipped):
+        targets_iter = expand_targets(targets)
+        while True:
+            chunk = [ip for _, ip in zip(range(CHUNK_SIZE), targets_iter)]
+            if not chunk:
+                return
+            states = _load_states(conn, chunk)
+            for (ip, port), row in states.items():
+                if row[0] == "open":
+                    known_open.setdefault(ip, set()).add(port)
+            for ip in chunk:
+                for port in port_list:
+                    row = states.get((ip, port))
+                    if row is not None and now - row[1] < min_age:
+                        skipped()
+                        continue
+                    yield priority(row, now, recent_window), ip, port, row[0] if row else None
+
+    if budget is None:
+        def skipped():
+            source.stats["planned"] -= 1
+        source = RescanSource(_stream(db_path, candidates, skipped), known_open,
+                              planned=count_probes(targets, port_list))
+        return source
+
+    conn = connect(db_path)
+    try:
+        selected = heapq.nlargest(budget, candidates(conn, lambda: None), key=lambda item: item[0])
+    finally:
+        conn.close()
+    # Host-major order so each host's probes finish close together
+    selected.sort(key=lambda item: (item[1], item[2]))
+    return RescanSource([(ip, port, state) for _, ip, port, state in selected], known_open)
+
+def _stream(db_path, candidates, skipped):
+    # Connects on first next(): the plan is made off the loop, the stream read on it
+    conn = connect(db_path)
+    try:
+        for _, ip, port, state in candidates(conn, skipped):
+            yield ip, port, state
+    finally:
+        conn.close()
+
+class Rescan:
+    """Options for an incremental rescan; the job runner calls plan() before scanning."""
+    def __init__(self, budget=None, min_age=0.0, recent_window=RECENT_WINDOW):
+        self.budget = budget
+        self.min_age = min_age
+        self.recent_window = recent_window
+        self.source = None
+
+    def plan(self, db_path, targets, ports):
+        self.source = plan_rescan(db_path, targets, ports, self.budget, self.min_age, self.recent_window)
+        return self.source
+
+    @property
+    def stats(self):
+        return dict(self.source.stats) if self.source is not None else {"planned": None}
+
+class RescanSource:
+    """scan_probes source for an incremental rescan; turns outcomes into state rows and diffs.
+
+    A previously open port that now refuses is "closed", a previously unknown or
+    closed port that answers is "opened". A host with recorded open ports where
+    none of this run's probes got any answer is reported once as "vanished"
+    instead of per-port closes. Per-host diffs are released when the host's last
+    probe completes; pop_updates() / pop_diffs() drain what is ready.
+
+    `probes` is a host-major list, or a lazy iterator with `planned` as its
+    upper bound; the planner takes skipped pairs off stats["planned"].
+    """
+    def __init__(self, probes, known_open, planned=None):
+        self.planned = len(probes) if planned is None else planned
+        self.stats = {"planned": self.planned, "opened": 0, "closed": 0, "vanished": 0, "unchanged": 0}
+        self._probes = iter(probes)
+        self._prior = {}  # (ip, port) -> state before this run, for probes handed out
+        # ip -> [probes outstanding, answered, previously open ports now silent]; a host's
+        # probes come in one run, so it is finished once a later host (or the end) comes up
+        self._hosts = {}
+        self._current = None
+        self._known_open = known_open
+        self._updates = deque()  # (ip, port, state, checked_at)
+        self._diffs = deque()  # {"ip", "port", "change", "at"}
+
+    def __len__(self):
+        return self.planned
+
+    def next_probe(self):
+        probe = next(self._probes, None)
+        if probe is None:
+            self._end_host(None)
+            return None
+        ip, port, state = probe
+        if ip != self._current:
+            self._end_host(ip)
+            self._hosts[ip] = [0, False, []]
+        self._hosts[ip][0] += 1
+        self._prior[(ip, port)] = state
+        return ip, port
+
+    def _end_host(self, next_ip):
+        # Every probe of the current host is out; it is done once they have all completed
+        ip, self._current = self._current, next_ip
+        if ip is not None and self._hosts[ip][0] == 0:
+            self._finish(ip, time.time())
+
+    def report(self, ip, port, outcome):
+        prior = self._prior.pop((ip, port), None)
+        host = self._hosts[ip]
+        host[0] -= 1
+        state = STATES.get(outcome)
+        at = time.time()
+        if state is not None:
+            self._updates.append((ip, port, state, at))
+            if state != "filtered":
+                host[1] = True
+            if state == "open" and prior != "open":
+                self._diff(ip, port, "opened", at)
+            elif state == "closed" and prior == "open":
+                self._diff(ip, port, "closed", at)
+            elif state == "filtered" and prior == "open":
+                # Closed, or the whole host is gone; decided once the host is done
+                host[2].append(port)
+            else:
+                self.stats["unchanged"] += 1
+        if host[0] == 0 and ip != self._current:
+            self._finish(ip, at)
+        return True
+
+    def _finish(self, ip, at):
+        host = self._hosts.pop(ip)
+        if host[2] and not host[1] and self._known_open.get(ip):
+            self._diff(ip, None, "vanished", at, ports=host[2])
+        else:
+            for silent in host[2]:
+                self._diff(ip, silent, "closed", at)
+
+    def _diff(self, ip, port, change, at, **extra):
+        self.stats[change] += 1
+        self._diffs.append({"ip": ip, "port": port, "change": change, "at": at, **extra})
+
+    def pop_updates(self):
+        updates = list(self._updates)
+        self._updates.clear()
+        return updates
+
+    def pop_diffs(self):
+        diffs = list(self._diffs)
+        self._diffs.clear()
+        return diffs
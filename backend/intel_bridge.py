@@ -1,31 +1,180 @@
 import json
 import logging
+import asyncio
+import sqlite3
 import aiohttp
 import os
+import time
+from collections import OrderedDict
+from db import DB_PATH
+from metrics import ENRICHMENT_SECONDS
 
 logger = logging.getLogger(__name__)
 
+SHODAN_API_URL = "https://api.shodan.io"
+
 class IntelligenceBridge:
-    def __init__(self, shodan_key=None):
+    def __init__(self, shodan_key=None, base_url=None, db_path=DB_PATH,
+                 cache_size=4096, cache_ttl=86400, concurrency=10, request_timeout=10, writer=None):
         self.shodan_key = shodan_key or os.getenv("SHODAN_API_KEY")
+        self.base_url = (base_url or os.getenv("SHODAN_API_URL") or SHODAN_API_URL).rstrip("/")
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.concurrency = concurrency
+        self.request_timeout = request_timeout
+        self.writer = writer  # optional persistence.BatchWriter for cache writes
+        self._cache = OrderedDict()  # ip -> (monotonic expiry, intel), in LRU order
+        self._inflight = {}  # ip -> Future shared by concurrent callers
+        self._session = None
+        self.waiting = 0  # fetch_many lookups queued behind the concurrency limit
+
+    async def _get_session(self):
+        """Returns the long-lived pooled session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _remember(self, ip, intel, age=0):
+        """Caches intel in process for what is left of its TTL; `age` is seconds since it was fetched."""
+        self._cache[ip] = (time.monotonic() + self.cache_ttl - age, intel)
+        self._cache.move_to_end(ip)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load_cached(self, ip):
+        """Reads a non-expired entry from the SQLite intel_cache table as (intel, age in seconds)."""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute(
+                    "SELECT data, strftime('%s', 'now') - strftime('%s', timestamp) FROM intel_cache "
+                    "WHERE ip = ? AND timestamp >= datetime('now', ?)",
+                    (ip, f"-{int(self.cache_ttl)} seconds"),
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Intel cache read failed: {e}")
+            return None
+        return (json.loads(row[0]), row[1]) if row else None
+
+    _STORE_SQL = "INSERT OR REPLACE INTO intel_cache (ip, data, timestamp) VALUES (?, ?, CURRENT_TIMESTAMP)"
+
+    def _store_cached(self, ip, intel):
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute(self._STORE_SQL, (ip, json.dumps(intel)))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Intel cache write failed: {e}")
 
     async def fetch_ip_intel(self, ip):
-        """Fetches intelligence about an IP from Shodan (Simulated if no key)."""
+        """Fetches intelligence about an IP from Shodan (Simulated if no key).
+
+        Lookups go through the in-process LRU, then the SQLite cache, and only then
+        upstream. Concurrent lookups for the same IP share a single upstream call.
+        """
         if not self.shodan_key:
             return self._get_mock_intel(ip)
-        
-        url = f"https://api.shodan.io/shodan/host/{ip}?key={self.shodan_key}"
+
+        cached = self._cache.get(ip)
+        if cached is not None:
+            expires, intel = cached
+            if expires > time.monotonic():
+                self._cache.move_to_end(ip)
+                return intel
+            del self._cache[ip]
+
+        future = self._inflight.get(ip)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[ip] = future
+        try:
+            intel = await self._resolve(ip)
+            future.set_result(intel)
+            return intel
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so waiter-less failures don't log "never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self._inflight[ip]
+
+    async def _resolve(self, ip):
+        cached = await asyncio.to_thread(self._load_cached, ip)
+        if cached is not None:
+            intel, age = cached
+            self._remember(ip, intel, age)
+            return intel
+
+        intel = await self._fetch_upstream(ip)
+        if intel is None:
+            return self._get_mock_intel(ip)
+
+        self._remember(ip, intel)
+        if self.writer is not None:
+            await self.writer.submit_async(self._STORE_SQL, (ip, json.dumps(intel)))
+        else:
+            await asyncio.to_thread(self._store_cached, ip, intel)
+        return intel
+
+    async def _fetch_upstream(self, ip):
+        url = f"{self.base_url}/shodan/host/{ip}"
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        logger.warning(f"Shodan API error: {response.status}")
-                        return self._get_mock_intel(ip)
+            session = await self._get_session()
+            async with session.get(url, params={"key": self.shodan_key}) as response:
+                if response.status == 200:
+                    return await response.json()
+                else:
+                    logger.warning(f"Shodan API error: {response.status}")
+                    return None
         except Exception as e:
             logger.error(f"Failed to fetch Shodan intel: {e}")
-            return self._get_mock_intel(ip)
+            return None
+
+    async def fetch_many(self, ips, concurrency=None):
+        """Enriches many IPs concurrently, at most `concurrency` lookups at a time."""
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def bounded(ip):
+            self.waiting += 1
+            try:
+                await semaphore.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                start = time.monotonic()
+                intel = await self.fetch_ip_intel(ip)
+                ENRICHMENT_SECONDS.observe(time.monotonic() - start)
+                return ip, intel
+            finally:
+                semaphore.release()
+
+        results = await asyncio.gather(*(bounded(ip) for ip in dict.fromkeys(ips)))
+        return dict(results)
 
     def _get_mock_intel(self, ip):
         """Mock intelligence for demonstration without an API key."""
@@ -38,9 +187,9 @@ class IntelligenceBridge:
         }
 
 if __name__ == "__main__":
-    import asyncio
     bridge = IntelligenceBridge()
     async def test():
-        intel = await bridge.fetch_ip_intel("8.8.8.8")
+        async with bridge:
+            intel = await bridge.fetch_ip_intel("8.8.8.8")
         print(f"Intel for 8.8.8.8: {json.dumps(intel, indent=2)}")
     asyncio.run(test())
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from scanner_core import AsyncScanner, ProbeCursor, Prefilter, count_probes
+from incremental import Rescan
+from sharding import ShardedScanner
+from adaptive import AdaptiveController
+from bitmap import ScanResults
+
+logger = logging.getLogger(__name__)
+
+# File descriptors kept back for the DB, HTTP clients and the API's own sockets
+FD_RESERVE = 256
+DEFAULT_BUDGET = 1024
+# Seconds between a job's persisted checkpoints
+CHECKPOINT_INTERVAL = 5.0
+
+def socket_budget(reserve=FD_RESERVE):
+    """Global probe budget derived from the process's open-file soft limit."""
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return DEFAULT_BUDGET
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_BUDGET * 4
+    return max(16, int((soft - reserve) * 0.8))
+
+class ScanJob:
+    def __init__(self, ips, ports, timeout=0.5, shards=1, adaptive=True, prefilter=None, rescan=None, banners=False,
+                 per_host=None, checkpoint_interval=CHECKPOINT_INTERVAL, hostnames=None, job_id=None):
+        if (prefilter is not None or rescan is not None or banners) and shards != 1:
+            raise ValueError("Prefilter, incremental and banner modes are not supported on sharded scans")
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.ips = ips
+        self.ports = ports
+        self.timeout = timeout
+        self.shards = shards
+        self.adaptive = adaptive
+        self.banners = banners
+        self.per_host = per_host
+        self.hostnames = hostnames or {}  # ip -> target hostnames that resolved to it
+        self.checkpoint_interval = checkpoint_interval
+        # queued -> running -> completed / cancelled / failed, or interrupted by a shutdown
+        self.status = "queued"
+        self.error = None
+        self.probes_total = count_probes(ips, ports)
+        self.open_found = 0
+        self.results = ScanResults()  # open ports found, one bitmap per host
+        self.dirty = set()  # hosts whose results changed since the last checkpoint
+        self.probes_offset = 0  # probes completed before a resume
+        self.prefilter = prefilter  # scanner_core.Prefilter, passed to scan_stream by the runner
+        self.rescan = rescan  # incremental.Rescan; the runner plans it and scans only that
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.profile = None  # collapsed-stack Counter once profiling is enabled
+        # shards=0 means one worker process per CPU; the budget share is fixed at start
+        if shards == 1:
+            controller = AdaptiveController(base_timeout=timeout, concurrency=64) if adaptive else None
+            self.scanner = AsyncScanner(timeout=timeout, concurrency=1, controller=controller, banners=banners,
+                                        per_host=per_host)
+        else:
+            self.scanner = ShardedScanner(shards=shards or None, timeout=timeout, concurrency=1, adaptive=adaptive,
+                                          per_host=per_host)
+        # Plain single-process scans walk a ProbeCursor so they can resume mid-way;
+        # the other modes restart from scratch
+        self.cursor = None
+        if shards == 1 and prefilter is None and rescan is None and checkpoint_interval:
+            self.cursor = ProbeCursor(ips, ports, per_host=self.scanner.per_host)
+        self.task = None
+
+    def spec(self):
+        """JSON-safe constructor arguments, enough to rebuild the job after a restart."""
+        prefilter = {"sentinels": list(self.prefilter.sentinels), "timeout": self.prefilter.timeout} if self.prefilter else None
+        rescan = None
+        if self.rescan is not None:
+            rescan = {"budget": self.rescan.budget, "min_age": self.rescan.min_age, "recent_window": self.rescan.recent_window}
+        return {
+            "ips": self.ips, "ports": self.ports, "timeout": self.timeout, "shards": self.shards,
+            "adaptive": self.adaptive, "prefilter": prefilter, "rescan": rescan, "banners": self.banners,
+            "per_host": self.per_host, "checkpoint_interval": self.checkpoint_interval, "hostnames": self.hostnames,
+        }
+
+    @classmethod
+    def from_spec(cls, spec, job_id=None):
+        kwargs = dict(spec)
+        if kwargs.get("prefilter"):
+            kwargs["prefilter"] = Prefilter(**kwargs["prefilter"])
+        if kwargs.get("rescan"):
+            kwargs["rescan"] = Rescan(**kwargs["rescan"])
+        return cls(job_id=job_id, **kwargs)
+
+    def restore(self, position, open_found, results):
+        """Continues from a ProbeCursor.position checkpoint with the `results` found so far."""
+        if self.cursor is None:
+            return
+        self.cursor = ProbeCursor(self.ips, self.ports, position, per_host=self.scanner.per_host)
+        self.probes_offset = self.cursor.completed
+        self.open_found = open_found
+        self.results = results
+
+    def checkpoint(self):
+        """(position, hosts with new results since the last call); position is None if not resumable."""
+        dirty, self.dirty = self.dirty, set()
+        return (self.cursor.position if self.cursor is not None else None), dirty
+
+    @property
+    def probes_done(self):
+        return self.probes_offset + self.scanner.probes_done
+
+    def record(self, ip, port):
+        """Called by the runner for every open port found."""
+        self.open_found += 1
+        self.results.add(ip, port)
+        self.dirty.add(ip)
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "cancelled", "failed", "interrupted")
+
+    def snapshot(self):
+        end = self.finished_at or time.time()
+        controller = getattr(self.scanner, "controller", None)
+        elapsed = end - self.started_at if self.started_at else 0.0
+        prefilter = dict(self.prefilter.stats) if self.prefilter is not None else None
+        # Hosts ruled out by the prefilter shrink the job as it goes
+        probes_total = self.probes_total - (prefilter["probes_saved"] if prefilter else 0)
+        rescan = self.rescan.stats if self.rescan is not None else None
+        if rescan and rescan["planned"] is not None:
+            probes_total = rescan["planned"]
+        return {
+            "id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "target_count": len(self.ips),
+            "port_count": len(self.ports),
+            "probes_total": probes_total,
+            "probes_done": self.probes_done,
+            "probes_remaining": max(0, probes_total - self.probes_done),
+            "probes_per_sec": round(self.probes_done / elapsed, 1) if elapsed > 0 else 0.0,
+            "open_found": self.open_found,
+            "hosts_found": len(self.results),
+            "prefilter": prefilter,
+            "rescan": rescan,
+            "concurrency": self.scanner.concurrency,
+            "shards": getattr(self.scanner, "shards", 1),
+            "resumable": self.cursor is not None,
+            "controller": controller.snapshot(top=5) if controller is not None else None,
+            "profile_samples": sum(self.profile.values()) if self.profile is not None else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class ScanJobManager:
+    """Queues scan jobs and splits one global socket budget across the running ones.
+
+    `runner` is a coroutine function taking a ScanJob; it drives job.scanner and
+    calls job.record() per open port. Each running job's scanner concurrency is
+    rebalanced to an equal share of the budget whenever a job starts or ends.
+    `listener`, if given, is called with the job on every status change.
+    """
+    def __init__(self, runner, budget=None, max_running=4, min_share=32, keep_finished=200, listener=None):
+        self.runner = runner
+        self.listener = listener
+        self.budget = budget or socket_budget()
+        self.max_running = max(1, min(max_running, self.budget // min_share or 1))
+        self.keep_finished = keep_finished
+        self.jobs = OrderedDict()
+        self.queue = deque()
+        self.running = set()
+        self.stopping = False
+
+    def submit(self, ips, ports, **kwargs):
+        return self.enqueue(ScanJob(ips, ports, **kwargs))
+
+    def enqueue(self, job):
+        """Queues an already built job, e.g. one restored from a checkpoint."""
+        self.jobs[job.id] = job
+        self.queue.append(job)
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.status == "queued":
+            self.queue.remove(job)
+            self._finish(job, "cancelled")
+        elif job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def shutdown(self):
+        # Jobs stopped here end up "interrupted", which marks them for resuming
+        self.stopping = True
+        while self.queue:
+            self._finish(self.queue.popleft(), "interrupted")
+        tasks = [job.task for job in self.running if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _dispatch(self):
+        while not self.stopping and self.queue and len(self.running) < self.max_running:
+            job = self.queue.popleft()
+            job.status = "running"
+            job.started_at = time.time()
+            self.running.add(job)
+            job.task = asyncio.get_running_loop().create_task(self._run(job))
+            self._notify(job)
+        self._rebalance()
+
+    def _notify(self, job):
+        if self.listener is not None:
+            try:
+                self.listener(job)
+            except Exception:
+                logger.exception("Scan job listener failed")
+
+    def _rebalance(self):
+        if not self.running:
+            return
+        share = max(1, self.budget // len(self.running))
+        for job in self.running:
+            job.scanner.concurrency = share
+
+    async def _run(self, job):
+        try:
+            await self.runner(job)
+            self._finish(job, "completed")
+        except asyncio.CancelledError:
+            self._finish(job, "interrupted" if self.stopping else "cancelled")
+        except Exception as e:
+            logger.exception(f"Scan job {job.id} failed")
+            job.error = str(e)
+            self._finish(job, "failed")
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        self.running.discard(job)
+        self._notify(job)
+        self._prune()
+        self._dispatch()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
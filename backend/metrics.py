@@ -0,0 +1,143 @@
+import bisect
+import threading
+
+# Connect / lookup / flush latencies, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield self.name + "_total", _format_labels(self.labels, label_values), value
+
+class Gauge:
+    """Point-in-time value, either set directly or computed by `collect` at scrape time.
+
+    `collect` returns a number, or an iterable of (label values, number) pairs
+    for a labelled gauge.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+
+    def set(self, value, *label_values):
+        self._values[label_values] = value
+
+    def samples(self):
+        if self.collect is None:
+            items = sorted(self._values.items())
+        else:
+            result = self.collect()
+            items = result if self.labels else [((), result)]
+        for label_values, value in items:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield self.name + "_bucket", '{le="' + _format_value(float(bound)) + '"}', cumulative
+        yield self.name + "_sum", "", total
+        yield self.name + "_count", "", cumulative
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Process-wide metrics; the engine modules record into these directly
+REGISTRY = Registry()
+PROBES = REGISTRY.counter("ghostscan_probes", "Completed connect probes by outcome.", labels=("outcome",))
+CONNECT_SECONDS = REGISTRY.histogram("ghostscan_connect_seconds", "Connect probe latency, answered or timed out.")
+ENRICHMENT_SECONDS = REGISTRY.histogram("ghostscan_enrichment_seconds", "IntelligenceBridge lookup latency per IP.")
+DB_FLUSH_SECONDS = REGISTRY.histogram("ghostscan_db_flush_seconds", "BatchWriter transaction commit latency.")
+DNS_SECONDS = REGISTRY.histogram("ghostscan_dns_seconds", "Hostname lookup latency for scan targets, cache misses only.")
@@ -0,0 +1,220 @@
+import asyncio
+import itertools
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from metrics import DB_FLUSH_SECONDS
+from db import register_functions
+
+logger = logging.getLogger(__name__)
+
+# Tuned for many small writes from one writer and concurrent readers
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+def connect(db_path, **kwargs):
+    """Opens a SQLite connection with the shared pragmas and SQL functions applied."""
+    conn = sqlite3.connect(db_path, **kwargs)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    register_functions(conn)
+    return conn
+
+# A batch that fails with a lock error is retried this many times, RETRY_DELAY doubling each time
+COMMIT_RETRIES = 3
+RETRY_DELAY = 0.2
+
+# SQLITE_BUSY, SQLITE_LOCKED: another connection holds the database; other errors won't clear on retry
+_BUSY_CODES = (5, 6)
+
+def _is_busy(error):
+    code = getattr(error, "sqlite_errorcode", None)  # Python 3.11+
+    if code is None:
+        return "locked" in str(error) or "busy" in str(error)
+    # Extended codes such as SQLITE_BUSY_SNAPSHOT keep the primary code in the low byte
+    return code & 0xff in _BUSY_CODES
+
+# Queue markers: None stops the writer, _TIMEOUT is a local flush-interval tick
+_TIMEOUT = object()
+
+class _Barrier:
+    """Queue marker that is acknowledged once everything before it is committed."""
+    def __init__(self):
+        self.done = threading.Event()
+
+class BatchWriter:
+    """Single writer thread that drains a bounded queue of (sql, params) statements.
+
+    Statements are committed with executemany in one transaction per batch, flushed
+    when `batch_size` statements are pending or `flush_interval` seconds have passed.
+    A full queue blocks submitters, which pushes back on the scanner feeding it.
+    """
+    def __init__(self, db_path, batch_size=500, flush_interval=0.5, max_queue=10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self.commit_listeners = []  # called as listener(conn) on the writer thread
+
+    def start(self):
+        with self._lock:
+            if not self._closed and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="ghostscan-db-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, sql, params=()):
+        """Queues one statement, blocking while the queue is full."""
+        if self._closed:
+            raise RuntimeError("BatchWriter is closed")
+        self.start()
+        self.queue.put((sql, params))
+
+    def submit_many(self, sql, rows):
+        for params in rows:
+            self.submit(sql, params)
+
+    def submit_nowait(self, sql, params=()):
+        """Queues one statement; raises queue.Full instead of waiting for room."""
+        if self._closed:
+            raise RuntimeError("BatchWriter is closed")
+        self.start()
+        self.queue.put_nowait((sql, params))
+
+    async def submit_async(self, sql, params=()):
+        """Queues one statement from the event loop; waits off-loop when the queue is full."""
+        try:
+            self.submit_nowait(sql, params)
+        except queue.Full:
+            await asyncio.to_thread(self.queue.put, (sql, params))
+
+    async def submit_many_async(self, sql, rows):
+        for params in rows:
+            await self.submit_async(sql, params)
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far has been committed."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        barrier = _Barrier()
+        self.queue.put(barrier)
+        return barrier.done.wait(timeout)
+
+    async def flush_async(self, timeout=None):
+        return await asyncio.to_thread(self.flush, timeout)
+
+    def close(self, timeout=10):
+        """Flushes pending writes and stops the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout)
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        conn = connect(self.db_path, check_same_thread=False)
+        batch, barriers = [], []
+        deadline = None
+        stop = False
+        try:
+            while not stop:
+                wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=wait)
+                except queue.Empty:
+                    item = _TIMEOUT
+                if item is None:
+                    stop = True
+                elif isinstance(item, _Barrier):
+                    barriers.append(item)
+                elif item is not _TIMEOUT:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+                if stop or barriers or item is _TIMEOUT or len(batch) >= self.batch_size:
+                    self._commit(conn, batch)
+                    batch, deadline = [], None
+                    for barrier in barriers:
+                        barrier.done.set()
+                    barriers = []
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        if not batch:
+            return
+        start = time.monotonic()
+        try:
+            committed = self._write(conn, batch)
+        finally:
+            DB_FLUSH_SECONDS.observe(time.monotonic() - start)
+        if not committed:
+            return
+        for listener in self.commit_listeners:
+            try:
+                listener(conn)
+            except Exception:
+                logger.exception("DB commit listener failed")
+
+    def _write(self, conn, batch):
+        """Commits a batch, retrying lock errors; returns whether anything was committed."""
+        for attempt in range(COMMIT_RETRIES + 1):
+            try:
+                with conn:
+                    # Group consecutive statements so each run goes through executemany
+                    for sql, group in itertools.groupby(batch, key=lambda item: item[0]):
+                        conn.executemany(sql, [params for _, params in group])
+                return True
+            except sqlite3.Error as e:
+                error = e
+                # Locked past busy_timeout, e.g. by a second writer process; anything else is a bad statement
+                if not _is_busy(e):
+                    break
+                if attempt < COMMIT_RETRIES:
+                    logger.warning(f"DB batch of {len(batch)} writes failed ({e}), retrying")
+                    time.sleep(RETRY_DELAY * 2 ** attempt)
+
+        # Replay statement by statement so one bad row doesn't take the batch down with it
+        logger.warning(f"DB batch of {len(batch)} writes failed ({error}), replaying one by one")
+        committed = 0
+        for index, (sql, params) in enumerate(batch):
+            try:
+                with conn:
+                    conn.execute(sql, params)
+                committed += 1
+            except sqlite3.Error as e:
+                if _is_busy(e):
+                    # Still locked: every remaining statement would wait out busy_timeout in turn
+                    logger.error(f"DB unavailable ({e}), dropped {len(batch) - index} writes")
+                    break
+                logger.error(f"DB write dropped ({e}): {' '.join(sql.split())[:80]} {params!r}")
+        return committed > 0
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_writer(db_path, **kwargs):
+    """Returns the process-wide writer for a database; its thread starts on first write."""
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None or writer._closed:
+            writer = _writers[db_path] = BatchWriter(db_path, **kwargs)
+        return writer
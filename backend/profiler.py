@@ -0,0 +1,85 @@
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval, on demand per scan job.
+
+    Scan jobs all share the event loop thread, so while several profiled jobs run
+    at once their samples overlap; a profile is exact only for a job running alone.
+    Stacks are kept in collapsed form ("outer;...;inner" -> samples), which
+    flamegraph.pl and speedscope read directly.
+    """
+    def __init__(self, interval=0.005, max_depth=64, max_stacks=5000):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.max_stacks = max_stacks
+        self.target_thread = None
+        self.profiles = {}  # job id -> Counter of collapsed stacks, while enabled
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def bind(self, thread_id=None):
+        """Chooses the thread to sample; defaults to the calling one (the event loop)."""
+        self.target_thread = thread_id or threading.get_ident()
+
+    def enable(self, job):
+        """Starts collecting samples into job.profile; returns False if already on."""
+        with self._lock:
+            if job.id in self.profiles:
+                return False
+            job.profile = Counter()
+            self.profiles[job.id] = job.profile
+            self._wake.clear()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ghostscan-profiler", daemon=True)
+                self._thread.start()
+        return True
+
+    def disable(self, job):
+        """Stops sampling for the job; what was collected stays on job.profile."""
+        with self._lock:
+            self.profiles.pop(job.id, None)
+            if not self.profiles:
+                self._wake.set()
+
+    def is_enabled(self, job):
+        return job.id in self.profiles
+
+    def _frame_name(self, frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            self._wake.wait(self.interval)
+            with self._lock:
+                # Exit under the lock so a concurrent enable() starts a fresh thread
+                if not self.profiles:
+                    self._thread = None
+                    return
+            target = self.target_thread
+            frame = sys._current_frames().get(target) if target and target != me else None
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < self.max_depth:
+                names.append(self._frame_name(frame))
+                frame = frame.f_back
+            stack = ";".join(reversed(names))
+            with self._lock:
+                for profile in self.profiles.values():
+                    if stack in profile or len(profile) < self.max_stacks:
+                        profile[stack] += 1
+                    else:
+                        profile["[truncated]"] += 1
+
+def collapsed(profile, limit=None):
+    """Renders a profile Counter as collapsed-stack text, busiest stacks first."""
+    return "".join(f"{stack} {count}\n" for stack, count in profile.most_common(limit))
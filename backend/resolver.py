@@ -0,0 +1,153 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+from collections import OrderedDict
+from metrics import DNS_SECONDS
+
+try:
+    import aiodns  # optional; real record TTLs and no getaddrinfo thread pool
+except ImportError:
+    aiodns = None
+
+logger = logging.getLogger(__name__)
+
+# getaddrinfo reports no TTL, so its answers live this long
+DEFAULT_TTL = 300.0
+# Names that did not resolve are retried after this long
+NEGATIVE_TTL = 60.0
+# Floor for record TTLs, so a TTL of 0 still dedupes a batch
+MIN_TTL = 5.0
+
+def is_address(target):
+    """True for an IP address or CIDR range, False for anything that needs resolving."""
+    try:
+        ipaddress.ip_network(target, strict=False)
+    except ValueError:
+        return False
+    return True
+
+class Resolver:
+    """Resolves hostnames concurrently with a TTL cache and negative caching.
+
+    At most `concurrency` lookups run at once, and concurrent lookups of one
+    name share a single query. Uses aiodns when installed, the event loop's
+    getaddrinfo otherwise. `family` picks A (AF_INET), AAAA (AF_INET6) or both
+    (AF_UNSPEC) records.
+    """
+    def __init__(self, concurrency=64, ttl=DEFAULT_TTL, negative_ttl=NEGATIVE_TTL, max_entries=100000,
+                 family=socket.AF_INET):
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.family = family
+        self.cache = OrderedDict()  # name -> (expires at, addresses); LRU order
+        self.stats = {"hits": 0, "negative_hits": 0, "lookups": 0, "failures": 0}
+        self._semaphore = None
+        self._inflight = {}  # name -> Task shared by everyone waiting on it
+        self._dns = None
+
+    async def resolve(self, name):
+        """Addresses for `name` (empty if it does not resolve); IP literals come back as is."""
+        name = name.strip().lower().rstrip(".")
+        if is_address(name):
+            return [name]
+        entry = self.cache.get(name)
+        if entry is not None and entry[0] > time.monotonic():
+            self.cache.move_to_end(name)
+            self.stats["hits" if entry[1] else "negative_hits"] += 1
+            return list(entry[1])
+        task = self._inflight.get(name)
+        if task is None:
+            task = self._inflight[name] = asyncio.ensure_future(self._fetch(name))
+            task.add_done_callback(lambda _: self._inflight.pop(name, None))
+        # A cancelled caller must not cancel the lookup others wait on
+        return list(await asyncio.shield(task))
+
+    async def resolve_many(self, names):
+        """{name: addresses} for every name, looked up concurrently."""
+        names = list(dict.fromkeys(names))
+        results = await asyncio.gather(*(self.resolve(name) for name in names))
+        return dict(zip(names, results))
+
+    async def expand(self, targets):
+        """Resolves the hostnames among scan targets and dedupes the addresses.
+
+        Returns (targets, hostnames, unresolved): targets are the CIDRs and
+        addresses to scan, each address once and none already inside a listed
+        CIDR; hostnames maps each address to the names that resolved to it;
+        unresolved lists names with no address.
+        """
+        if isinstance(targets, str):
+            targets = targets.split(",")
+        literals, names = [], []
+        for target in targets:
+            target = target.strip()
+            if target:
+                (literals if is_address(target) else names).append(target)
+        resolved = await self.resolve_many(names)
+
+        networks = [ipaddress.ip_network(t, strict=False) for t in literals if "/" in t]
+        def covered(ip):
+            addr = ipaddress.ip_address(ip)
+            return any(addr in net for net in networks)
+
+        expanded, seen, hostnames = [], set(), {}
+        for target in literals:
+            if "/" not in target:
+                target = str(ipaddress.ip_address(target))
+                if covered(target):
+                    continue
+            if target not in seen:
+                seen.add(target)
+                expanded.append(target)
+        for name, addrs in resolved.items():
+            for ip in addrs:
+                hostnames.setdefault(ip, []).append(name)
+                if ip not in seen and not covered(ip):
+                    seen.add(ip)
+                    expanded.append(ip)
+        unresolved = [name for name, addrs in resolved.items() if not addrs]
+        return expanded, hostnames, unresolved
+
+    async def _fetch(self, name):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            self.stats["lookups"] += 1
+            start = time.monotonic()
+            try:
+                addrs, ttl = await self._query(name)
+            except (OSError, UnicodeError) as e:
+                addrs, ttl = (), self.negative_ttl
+                logger.debug(f"DNS lookup for {name} failed: {e}")
+            finally:
+                DNS_SECONDS.observe(time.monotonic() - start)
+        if not addrs:
+            self.stats["failures"] += 1
+            ttl = self.negative_ttl
+        self.cache[name] = (time.monotonic() + ttl, addrs)
+        self.cache.move_to_end(name)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return addrs
+
+    async def _query(self, name):
+        """(addresses, ttl) for a name; raises OSError when it cannot be resolved."""
+        if aiodns is not None:
+            if self._dns is None:
+                self._dns = aiodns.DNSResolver()
+            qtypes = {socket.AF_INET: ("A",), socket.AF_INET6: ("AAAA",)}.get(self.family, ("A", "AAAA"))
+            records = []
+            for qtype in qtypes:
+                try:
+                    records += await self._dns.query(name, qtype)
+                except aiodns.error.DNSError:
+                    continue
+            addrs = tuple(dict.fromkeys(record.host for record in records))
+            ttl = max(MIN_TTL, min(record.ttl for record in records)) if records else self.negative_ttl
+            return addrs, ttl
+        infos = await asyncio.get_running_loop().getaddrinfo(name, None, family=self.family, type=socket.SOCK_STREAM)
+        return tuple(dict.fromkeys(info[4][0] for info in infos)), self.ttl
@@ -1,50 +1,599 @@
 import asyncio
+import ipaddress
+import itertools
 import socket
 import logging
+import time
+from collections import deque
 from datetime import datetime
+from adaptive import RESOURCE_ERRNOS
+from metrics import PROBES, CONNECT_SECONDS
+from banners import grab_banner, classify, BANNER_TIMEOUT
+from bitmap import ScanResults
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+def expand_targets(targets):
+    """Lazily expands IPs and CIDR ranges into individual host addresses."""
+    if isinstance(targets, str):
+        targets = targets.split(",")
+    for target in targets:
+        target = target.strip()
+        if not target:
+            continue
+        if "/" in target:
+            for addr in ipaddress.ip_network(target, strict=False).hosts():
+                yield str(addr)
+        else:
+            yield target
+
+# The 100 most common open TCP ports, most common first (nmap-services frequencies)
+TOP_PORTS = (
+    80, 23, 443, 21, 22, 25, 3389, 110, 445, 139, 143, 53, 135, 3306, 8080, 1723, 111, 995, 993, 5900,
+    1025, 587, 8888, 199, 1720, 465, 548, 113, 81, 6001, 10000, 514, 5060, 179, 1026, 2000, 8443, 8000, 32768, 554,
+    26, 1433, 49152, 2001, 515, 8008, 49154, 1027, 5666, 646, 5000, 5631, 631, 49153, 8081, 2049, 88, 79, 5800, 106,
+    2121, 1110, 49155, 6000, 513, 990, 5357, 427, 49156, 543, 544, 5101, 144, 7, 389, 8009, 3128, 444, 9999, 5009,
+    7070, 5190, 3000, 5432, 1900, 3986, 13, 1029, 9, 5051, 6646, 49157, 1028, 873, 1755, 2717, 4899, 9100, 119, 37,
+)
+
+def expand_ports(spec):
+    """Lazily expands a port spec ("22,80,8000-8100,top20" or a list of ints/ranges) into ports.
+
+    "topN" stands for the first N of TOP_PORTS.
+    """
+    if isinstance(spec, str):
+        spec = spec.split(",")
+    for item in spec:
+        if isinstance(item, int):
+            yield item
+            continue
+        item = str(item).strip().lower()
+        if not item:
+            continue
+        if item.startswith("top"):
+            count = int(item[3:])
+            if not 0 < count <= len(TOP_PORTS):
+                raise ValueError(f"{item}: expected top1 to top{len(TOP_PORTS)}")
+            yield from TOP_PORTS[:count]
+        elif "-" in item:
+            start, end = item.split("-", 1)
+            yield from range(int(start), int(end) + 1)
+        else:
+            yield int(item)
+
+def count_hosts(target):
+    """Number of addresses expand_targets yields for one target, without expanding it."""
+    target = target.strip()
+    if "/" not in target:
+        return 1 if target else 0
+    net = ipaddress.ip_network(target, strict=False)
+    if net.num_addresses <= 2:
+        return net.num_addresses
+    # hosts() drops the network/broadcast addresses (IPv4) or the router anycast (IPv6)
+    return net.num_addresses - (2 if net.version == 4 else 1)
+
+def count_probes(targets, ports):
+    """Size of the target x port space, computed arithmetically."""
+    if isinstance(targets, str):
+        targets = targets.split(",")
+    return sum(count_hosts(t) for t in targets) * sum(1 for _ in expand_ports(ports))
+
+def iter_hosts(targets, start=0):
+    """expand_targets() minus the first `start` hosts; whole targets are skipped arithmetically."""
+    if isinstance(targets, str):
+        targets = targets.split(",")
+    for target in targets:
+        if start:
+            count = count_hosts(target)
+            if start >= count:
+                start -= count
+                continue
+        hosts = expand_targets([target])
+        if start:
+            hosts = itertools.islice(hosts, start, None)
+            start = 0
+        yield from hosts
+
+def iter_probes(targets, ports, start=0):
+    """Yields (ip, port) pairs host-major without materializing the target space.
+
+    `start` skips that many pairs.
+    """
+    port_list = list(expand_ports(ports))
+    if not port_list:
+        return
+    skip_hosts, skip_ports = divmod(start, len(port_list))
+    for ip in iter_hosts(targets, skip_hosts):
+        for port in port_list[skip_ports:]:
+            yield ip, port
+        skip_ports = 0
+
 class AsyncScanner:
-    def __init__(self, timeout=0.5, concurrency=500):
+    # Retries for probes that failed on our side (out of fds/buffers), not the target's
+    RESOURCE_RETRIES = 2
+
+    def __init__(self, timeout=0.5, concurrency=500, controller=None, banners=False, banner_timeout=BANNER_TIMEOUT,
+                 per_host=None):
         self.timeout = timeout
         self.concurrency = concurrency
+        # In-flight cap per target host for scan_stream; None means PER_HOST_LIMIT
+        self.per_host = per_host or PER_HOST_LIMIT
         self.semaphore = asyncio.Semaphore(concurrency)
+        self.probes_done = 0
+        self.in_flight = 0
+        self.waiting = 0  # scan_port callers queued on the semaphore
+        self._source = None  # what scan_probes is drawing from, for probes_held / hosts_capped
+        self.prefilter_stats = None  # set by scan_stream when a Prefilter is used
+        # Optional adaptive.AdaptiveController: per-network timeouts, AIMD concurrency
+        self.controller = controller
+        # Banner grabbing reads from the probe's own connection before closing it;
+        # results wait in `services` keyed by (ip, port) until the consumer pops them
+        self.banners = banners
+        self.banner_timeout = banner_timeout
+        self.services = {}
+
+    @property
+    def window(self):
+        """Probes allowed in flight: the controller's value, capped by `concurrency`."""
+        if self.controller is None:
+            return self.concurrency
+        # Keep the controller from growing past the share it can actually use
+        self.controller.max_concurrency = self.concurrency
+        return max(1, min(self.concurrency, self.controller.concurrency))
+
+    @property
+    def probes_held(self):
+        """Probes a HostLimit is holding back for hosts at their per-host cap."""
+        return getattr(self._source, "held", 0)
+
+    @property
+    def hosts_capped(self):
+        """Hosts with `per_host` probes in flight, held back until one completes."""
+        return getattr(self._source, "capped", 0)
 
     async def scan_port(self, ip, port):
         """Probes a single port on a given IP."""
-        async with self.semaphore:
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            return port, await self._connect(ip, port) == "open"
+        finally:
+            self.semaphore.release()
+
+    async def _connect(self, ip, port, timeout=None):
+        """Returns the probe outcome: open, refused, timeout, error or resource."""
+        controller = self.controller
+        if timeout is None:
+            timeout = controller.timeout_for(ip, self.timeout) if controller else self.timeout
+        for attempt in range(self.RESOURCE_RETRIES + 1):
+            start = time.monotonic()
+            writer = None
             try:
                 # Use wait_for to enforce timeout on the connection attempt
                 conn = asyncio.open_connection(ip, port)
-                reader, writer = await asyncio.wait_for(conn, timeout=self.timeout)
-                writer.close()
-                await writer.wait_closed()
-                return port, True
-            except (asyncio.TimeoutError, ConnectionRefusedError, OSError):
-                return port, False
-
-    async def scan_range(self, ip_range, ports):
-        """Scans a list of IPs and ports concurrently."""
-        tasks = []
-        for ip in ip_range:
-            for port in ports:
-                tasks.append(self.scan_port(ip, port))
-        
-        results = await asyncio.gather(*tasks)
-        
-        # Organize results by IP
-        findings = {}
-        for i, (port, is_open) in enumerate(results):
-            ip = ip_range[i // len(ports)]
-            if ip not in findings:
-                findings[ip] = []
+                reader, writer = await asyncio.wait_for(conn, timeout=timeout)
+                rtt, outcome = time.monotonic() - start, "open"
+            except asyncio.TimeoutError:
+                rtt, outcome = None, "timeout"
+            except ConnectionRefusedError:
+                rtt, outcome = time.monotonic() - start, "refused"
+            except OSError as e:
+                rtt = None
+                outcome = "resource" if e.errno in RESOURCE_ERRNOS else "error"
+            # Connect latency only: the banner read and the close come after
+            CONNECT_SECONDS.observe(time.monotonic() - start)
+            PROBES.inc(outcome)
+            if controller is not None:
+                controller.observe(ip, outcome, rtt)
+            if writer is not None:
+                try:
+                    if self.banners:
+                        banner = await grab_banner(reader, writer, port, self.banner_timeout)
+                        self.services[(ip, port)] = classify(port, banner)
+                finally:
+                    writer.close()
+                    try:
+                        await writer.wait_closed()
+                    except OSError:
+                        pass  # reset by the peer after the banner exchange
+            if outcome != "resource" or attempt == self.RESOURCE_RETRIES:
+                return outcome
+            await asyncio.sleep(0.05 * (attempt + 1))
+
+    async def _probe(self, ip, port, timeout=None):
+        # The scan window already bounds concurrency, so skip the semaphore
+        return ip, port, await self._connect(ip, port, timeout)
+
+    async def scan_stream(self, targets, ports, open_only=True, prefilter=None):
+        """Yields (ip, port, is_open) as probes complete, keeping at most `concurrency` in flight.
+
+        Targets and ports are expanded lazily, so memory stays flat regardless of
+        the size of the target space. Probes are interleaved across hosts with at
+        most `per_host` in flight on each (see ProbeCursor).
+        With open_only=False closed probes are yielded too.
+        With a Prefilter, hosts are first checked for liveness on its sentinel ports
+        and only hosts that answered get the full port list.
+        """
+        if prefilter is None:
+            probes = ProbeCursor(targets, ports, per_host=self.per_host)
+        else:
+            probes = prefilter.schedule(targets, ports, self.timeout)
+            self.prefilter_stats = prefilter.stats
+        async for result in self.scan_probes(probes, open_only):
+            yield result
+
+    async def scan_probes(self, probes, open_only=True):
+        """Runs (ip, port) pairs through the bounded in-flight window.
+
+        `probes` is an iterator, or a source with next_probe() / report(ip, port,
+        outcome) that can hand out follow-up probes based on earlier outcomes
+        (see Prefilter). Sources other than a ProbeCursor go through a HostLimit,
+        so no host has more than `per_host` probes in flight. The window
+        (`concurrency`, or the controller's value under it) is re-read on every
+        refill, so it can be retuned mid-scan, and
+        `probes_done` counts every completed probe, open or not.
+        """
+        if hasattr(probes, "next_probe"):
+            source = probes
+        else:
+            source = _IteratorSource(probes)
+        if not isinstance(source, ProbeCursor):
+            source = HostLimit(source, self.per_host)
+        self._source = source
+        pending = set()
+        try:
+            while True:
+                while len(pending) < self.window:
+                    probe = source.next_probe()
+                    if probe is None:
+                        break
+                    pending.add(asyncio.ensure_future(self._probe(*probe)))
+                self.in_flight = len(pending)
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                self.in_flight = len(pending)
+                self.probes_done += len(done)
+                for task in done:
+                    ip, port, outcome = task.result()
+                    if not source.report(ip, port, outcome):
+                        continue
+                    is_open = outcome == "open"
+                    if is_open:
+                        logger.info(f"FIND: {ip}:{port} is OPEN")
+                    if is_open or not open_only:
+                        yield ip, port, is_open
+        finally:
+            self.in_flight = 0
+            self._source = None
+            for task in pending:
+                task.cancel()
+
+    async def scan_range(self, ip_range, ports, prefilter=None, bitmap=False):
+        """Scans a list of IPs and ports concurrently.
+
+        Returns {ip: sorted open ports}, or the bitmap.ScanResults behind it
+        with bitmap=True.
+        """
+        findings = ScanResults()
+        async for ip, port, is_open in self.scan_stream(ip_range, ports, open_only=False, prefilter=prefilter):
+            host = findings.add_host(ip)
             if is_open:
-                findings[ip].append(port)
-                logger.info(f"FIND: {ip}:{port} is OPEN")
-        
-        return findings
+                host.add(port)
+        if prefilter is not None:
+            # Hosts dropped by the prefilter never got a result of their own
+            for ip in expand_targets(ip_range):
+                findings.add_host(ip)
+        return findings if bitmap else findings.to_dict()
+
+class _IteratorSource:
+    """Adapts a plain (ip, port) iterator to the scan_probes source interface."""
+    def __init__(self, probes):
+        self._probes = iter(probes)
+
+    def next_probe(self):
+        return next(self._probes, None)
+
+    def report(self, ip, port, outcome):
+        return True
+
+# Fair scheduling: probes in flight per host, and hosts interleaved at minimum
+PER_HOST_LIMIT = 32
+HOST_SPREAD = 64
+
+class _HostProgress:
+    __slots__ = ("index", "ip", "next", "done", "finished_ahead", "in_flight")
+
+    def __init__(self, index, ip, done=0):
+        self.index = index
+        self.ip = ip
+        self.next = done  # next port index to hand out
+        self.done = done  # low-water mark: every port index below it has completed
+        self.finished_ahead = set()  # completed port indexes above the low-water mark
+        self.in_flight = 0
+
+class ProbeCursor:
+    """scan_probes source that interleaves hosts and caps the probes in flight per host.
+
+    Probes are handed out round-robin over at least `spread` hosts at a time,
+    and no host gets more than `per_host` in flight while other hosts still have
+    work, so a slow or rate-limiting target holds a few slots of the window
+    instead of all of them. When every active host is at its cap another host is
+    started, so the window still fills. Once no hosts are left to start, capped
+    hosts wait: next_probe() returns None until a probe completes, and
+    scan_probes waits on what is in flight before asking again. The one
+    exception is the last host with ports left, which no other host could take
+    slots from, so it may fill the window.
+
+    `position` is a compact, JSON-safe checkpoint: [next host index, [[host
+    index, ports done], ...]] for the hosts still in progress. Hosts before the
+    next index that are not listed are finished. Resuming from it re-probes
+    only ports that completed out of order. `hosts` replaces the target
+    expansion with an explicit host iterator (not resumable); a live feed may
+    yield None for "nothing ready yet", which ends the current scan_probes
+    pass without exhausting the cursor, so it can be run through again.
+    """
+    def __init__(self, targets, ports, start=None, per_host=PER_HOST_LIMIT, spread=HOST_SPREAD, hosts=None):
+        self.port_list = list(expand_ports(ports))
+        self.per_host = per_host or float("inf")
+        self.spread = spread
+        self._rotation = deque()  # hosts with ports left to hand out, in turn order
+        self._open = {}  # host index -> _HostProgress, until all its probes completed
+        self._entries = {}  # (ip, port) -> deque of (host, port index) in flight
+        self._started_all = False  # the host iterator is exhausted
+        self._next_index, resume = (0, {}) if start is None else (start[0], dict(start[1]))
+        self.completed = self._next_index * len(self.port_list) - sum(len(self.port_list) - done for done in resume.values())
+        if hosts is not None:
+            self._hosts = enumerate(hosts)
+            return
+        if resume:
+            # Unfinished hosts from the checkpoint go first
+            first = min(resume)
+            for index, ip in zip(range(first, self._next_index), iter_hosts(targets, first)):
+                if index in resume:
+                    host = self._open[index] = _HostProgress(index, ip, resume[index])
+                    self._rotation.append(host)
+        self._hosts = enumerate(iter_hosts(targets, self._next_index), self._next_index)
+
+    @property
+    def capped(self):
+        return sum(1 for host in self._open.values() if host.in_flight >= self.per_host)
+
+    @property
+    def position(self):
+        return [self._next_index, [[host.index, host.done] for host in self._open.values()]]
+
+    def _start_host(self):
+        item = next(self._hosts, None)
+        if item is None:
+            self._hosts = iter(())
+            self._started_all = True
+            return None
+        index, ip = item
+        if ip is None:
+            return None
+        self._next_index = index + 1
+        host = self._open[index] = _HostProgress(index, ip)
+        self._rotation.append(host)
+        return host
+
+    def _hand_out(self, host):
+        port_index = host.next
+        host.next += 1
+        host.in_flight += 1
+        port = self.port_list[port_index]
+        self._entries.setdefault((host.ip, port), deque()).append((host, port_index))
+        return host.ip, port
+
+    def next_probe(self):
+        if not self.port_list:
+            return None
+        # Keep at least `spread` hosts in the rotation
+        if len(self._rotation) < self.spread:
+            host = self._start_host()
+            if host is not None:
+                return self._take(host)
+        for _ in range(len(self._rotation)):
+            host = self._rotation.popleft()
+            self._rotation.append(host)
+            if host.in_flight < self.per_host:
+                return self._take(host)
+        host = self._start_host()
+        if host is not None:
+            return self._take(host)
+        if self._started_all and len(self._rotation) == 1:
+            # The cap only shares the window between hosts; the last one left gets all of it
+            return self._take(self._rotation[0])
+        # Every host with work left is at its cap
+        return None
+
+    def _take(self, host):
+        probe = self._hand_out(host)
+        if host.next >= len(self.port_list):
+            self._rotation.remove(host)
+        return probe
+
+    def report(self, ip, port, outcome):
+        entries = self._entries[(ip, port)]
+        host, port_index = entries.popleft()
+        if not entries:
+            del self._entries[(ip, port)]
+        host.in_flight -= 1
+        self.completed += 1
+        if port_index == host.done:
+            host.done += 1
+            while host.done in host.finished_ahead:
+                host.finished_ahead.discard(host.done)
+                host.done += 1
+        else:
+            host.finished_ahead.add(port_index)
+        if host.done >= len(self.port_list):
+            del self._open[host.index]
+        return True
+
+# Probes a HostLimit may hold back for capped hosts before it stops pulling from its source
+HELD_LIMIT = 16384
+
+class HostLimit:
+    """Caps the probes in flight per host for a source that has no cap of its own.
+
+    Probes for a host already at `per_host` are held back, in order, and handed
+    out as that host's probes complete, while probes for other hosts go out in
+    the meantime. The prefilter and incremental sources go through this in
+    scan_probes; ProbeCursor enforces the same cap itself.
+    """
+    def __init__(self, source, per_host=PER_HOST_LIMIT, held_limit=HELD_LIMIT):
+        self.source = source
+        self.per_host = per_host or float("inf")
+        self.held_limit = held_limit
+        self.in_flight = {}  # ip -> probes in flight
+        self._held = {}  # ip -> deque of probes held back
+        self._held_count = 0
+        self._ready = deque()  # hosts with held probes that may have room again
+        self._queued = set()
+
+    @property
+    def held(self):
+        return self._held_count
+
+    @property
+    def capped(self):
+        return sum(1 for count in self.in_flight.values() if count >= self.per_host)
+
+    def next_probe(self):
+        while self._ready:
+            ip = self._ready.popleft()
+            self._queued.discard(ip)
+            held = self._held.get(ip)
+            if held and self.in_flight.get(ip, 0) < self.per_host:
+                probe = held.popleft()
+                self._held_count -= 1
+                if not held:
+                    del self._held[ip]
+                probe = self._hand_out(ip, probe)
+                if held and self.in_flight[ip] < self.per_host:
+                    # Several completions may have freed several slots; keep refilling this host
+                    self._queued.add(ip)
+                    self._ready.append(ip)
+                return probe
+        while self._held_count < self.held_limit:
+            probe = self.source.next_probe()
+            if probe is None:
+                return None
+            ip = probe[0]
+            if ip not in self._held and self.in_flight.get(ip, 0) < self.per_host:
+                return self._hand_out(ip, probe)
+            self._held.setdefault(ip, deque()).append(probe)
+            self._held_count += 1
+        return None
+
+    def _hand_out(self, ip, probe):
+        self.in_flight[ip] = self.in_flight.get(ip, 0) + 1
+        return probe
+
+    def report(self, ip, port, outcome):
+        count = self.in_flight[ip] - 1
+        if count:
+            self.in_flight[ip] = count
+        else:
+            del self.in_flight[ip]
+        if ip in self._held and ip not in self._queued:
+            self._queued.add(ip)
+            self._ready.append(ip)
+        return self.source.report(ip, port, outcome)
+
+# Ports most likely to answer (open or RST) on a live host
+SENTINEL_PORTS = (80, 443, 22, 445, 3389, 8080)
+SENTINEL_TIMEOUT = 0.3
+
+class Prefilter:
+    """Host liveness prefilter: sentinel ports first, the full port list only on live hosts.
+
+    A host is live once any sentinel answers, open or refused (a RST proves the
+    host is up). Follow-up probes for live hosts are handed out before new
+    sentinels, so results still stream while the sweep is in progress. Sentinel
+    ports that are also in the port list count as real results when they answer;
+    on live hosts, the ones that timed out under the short sentinel timeout are
+    re-probed with the normal one. `stats` tracks the probes saved.
+    """
+    def __init__(self, sentinels=SENTINEL_PORTS, timeout=None):
+        self.sentinels = tuple(dict.fromkeys(sentinels))
+        if not self.sentinels:
+            raise ValueError("Prefilter needs at least one sentinel port")
+        self.timeout = timeout
+        self.stats = {"hosts": 0, "hosts_alive": 0, "sentinel_probes": 0, "full_probes": 0, "probes_saved": 0}
+
+    def schedule(self, targets, ports, scan_timeout):
+        return _PrefilterSource(self, targets, list(expand_ports(ports)), scan_timeout)
+
+class _PrefilterSource:
+    def __init__(self, prefilter, targets, port_list, scan_timeout):
+        self.stats = prefilter.stats
+        self.sentinels = prefilter.sentinels
+        self.sentinel_timeout = prefilter.timeout or min(scan_timeout, SENTINEL_TIMEOUT)
+        self.port_list = port_list
+        self.port_set = set(port_list)
+        sentinels = set(self.sentinels)
+        self.followup_ports = [port for port in port_list if port not in sentinels]
+        # Sentinels outside the port list are pure overhead on live hosts
+        self.overhead = len(sentinels - self.port_set)
+        self._targets = expand_targets(targets)
+        self._sentinel_queue = iter(())
+        self._followups = deque()  # (ip, port iterator) for hosts known to be live
+        self._hosts = {}  # ip -> [sentinels outstanding, alive, ports to retry]
+        self._sentinel_probes = set()  # (ip, port) sentinel probes in flight
+
+    def next_probe(self):
+        while self._followups:
+            ip, ports = self._followups[0]
+            port = next(ports, None)
+            if port is not None:
+                # Round-robin over live hosts rather than one host's whole port list at a time
+                self._followups.rotate(-1)
+                self.stats["full_probes"] += 1
+                return ip, port
+            self._followups.popleft()
+        probe = next(self._sentinel_queue, None)
+        if probe is None:
+            ip = next(self._targets, None)
+            if ip is None:
+                return None
+            self.stats["hosts"] += 1
+            self._hosts[ip] = [len(self.sentinels), False, []]
+            self._sentinel_queue = ((ip, port) for port in self.sentinels)
+            probe = next(self._sentinel_queue)
+        self._sentinel_probes.add(probe)
+        self.stats["sentinel_probes"] += 1
+        return probe + (self.sentinel_timeout,)
+
+    def report(self, ip, port, outcome):
+        """Updates host liveness; returns whether the probe is a result for the caller."""
+        if (ip, port) not in self._sentinel_probes:
+            return True
+        self._sentinel_probes.discard((ip, port))
+        host = self._hosts[ip]
+        host[0] -= 1
+        answered = outcome in ("open", "refused")
+        if answered and not host[1]:
+            host[1] = True
+            self.stats["hosts_alive"] += 1
+            self._followups.append((ip, iter(self.followup_ports)))
+        elif not answered and port in self.port_set:
+            host[2].append(port)
+        if host[0] == 0:
+            del self._hosts[ip]
+            if host[1]:
+                if host[2]:
+                    self._followups.append((ip, iter(host[2])))
+                self.stats["probes_saved"] -= self.overhead + len(host[2])
+            else:
+                self.stats["probes_saved"] += len(self.port_list) - len(self.sentinels)
+        # Unanswered sentinels are either retried (live host) or moot (dead host)
+        return answered and port in self.port_set
 
 async def main_test():
     scanner = AsyncScanner(concurrency=100)
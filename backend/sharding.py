@@ -0,0 +1,213 @@
+import asyncio
+import concurrent.futures
+import ipaddress
+import itertools
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from multiprocessing.connection import wait as wait_connections
+from scanner_core import PER_HOST_LIMIT, AsyncScanner, ProbeCursor, expand_targets, expand_ports, count_hosts
+from adaptive import AdaptiveController
+from metrics import PROBES
+from bitmap import ScanResults
+
+logger = logging.getLogger(__name__)
+
+# Wire format for worker -> parent batches: a header with the shard index, the
+# number of probes completed since the last batch, the worker's probes in flight
+# and its per-outcome probe counts since the last batch, then one record per finding:
+#   port (u16), flags (u8: bit0 open, bit1 textual address), address length (u8), address bytes
+OUTCOMES = ("open", "refused", "timeout", "error", "resource")
+_HEADER = struct.Struct(f"!HII{len(OUTCOMES)}I")
+_RECORD = struct.Struct("!HBB")
+_OPEN, _TEXT = 1, 2
+
+BATCH_SIZE = 512
+BATCH_INTERVAL = 0.05
+
+def encode_batch(probes_done, results, shard=0, in_flight=0, outcomes=None):
+    counts = [(outcomes or {}).get(outcome, 0) for outcome in OUTCOMES]
+    parts = [_HEADER.pack(shard, probes_done, in_flight, *counts)]
+    for ip, port, is_open in results:
+        try:
+            addr, flags = ipaddress.ip_address(ip).packed, 0
+        except ValueError:
+            addr, flags = ip.encode(), _TEXT
+        parts.append(_RECORD.pack(port, flags | (_OPEN if is_open else 0), len(addr)))
+        parts.append(addr)
+    return b"".join(parts)
+
+def decode_batch(data):
+    """Returns ((shard, probes_done, in_flight, outcomes), results)."""
+    shard, probes_done, in_flight, *counts = _HEADER.unpack_from(data, 0)
+    outcomes = {outcome: n for outcome, n in zip(OUTCOMES, counts) if n}
+    offset = _HEADER.size
+    results = []
+    while offset < len(data):
+        port, flags, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        addr = data[offset:offset + length]
+        offset += length
+        ip = addr.decode() if flags & _TEXT else str(ipaddress.ip_address(addr))
+        results.append((ip, port, bool(flags & _OPEN)))
+    return (shard, probes_done, in_flight, outcomes), results
+
+def shard_probes(targets, ports, index, count, per_host=PER_HOST_LIMIT):
+    """ProbeCursor over this shard's slice of the target x port space.
+
+    Hosts are dealt round-robin across shards; when there are fewer hosts than
+    shards the port list is dealt instead, so a single host still spreads out.
+    """
+    targets = targets.split(",") if isinstance(targets, str) else list(targets)
+    port_list = list(expand_ports(ports))
+    if sum(count_hosts(t) for t in targets) >= count:
+        hosts = itertools.islice(expand_targets(targets), index, None, count)
+        return ProbeCursor(None, port_list, per_host=per_host, hosts=hosts)
+    return ProbeCursor(None, port_list[index::count], per_host=per_host, hosts=expand_targets(targets))
+
+def _shard_worker(conn, index, count, targets, ports, concurrency, timeout, open_only, adaptive, per_host):
+    """Process entry point: scans one shard on its own event loop."""
+    async def run():
+        controller = AdaptiveController(base_timeout=timeout, concurrency=min(64, concurrency)) if adaptive else None
+        scanner = AsyncScanner(timeout=timeout, concurrency=concurrency, controller=controller, per_host=per_host)
+        batch, reported = [], 0
+        counted = dict.fromkeys(OUTCOMES, 0)
+
+        def send():
+            # This process's PROBES counter only sees this shard; ship the deltas upstream
+            outcomes = {outcome: PROBES.value(outcome) - counted[outcome] for outcome in OUTCOMES}
+            for outcome, n in outcomes.items():
+                counted[outcome] += n
+            conn.send_bytes(encode_batch(scanner.probes_done - reported, batch, index, scanner.in_flight, outcomes))
+
+        deadline = time.monotonic() + BATCH_INTERVAL
+        async for result in scanner.scan_probes(shard_probes(targets, ports, index, count, scanner.per_host), open_only):
+            batch.append(result)
+            if len(batch) >= BATCH_SIZE or time.monotonic() >= deadline:
+                send()
+                reported, batch = scanner.probes_done, []
+                deadline = time.monotonic() + BATCH_INTERVAL
+        send()
+
+    logging.getLogger("scanner_core").setLevel(logging.WARNING)
+    try:
+        asyncio.run(run())
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
+    finally:
+        conn.close()
+
+class ShardedScanner:
+    """Splits a scan across worker processes, each with its own loop and scanner.
+
+    `concurrency` is the total socket budget; every shard gets an equal slice.
+    Results stream back over pipes in a packed binary format and are merged
+    into the same (ip, port, is_open) stream / findings dict as AsyncScanner.
+    Worker probe outcomes are folded into this process's metrics as batches arrive.
+    """
+    def __init__(self, shards=None, timeout=0.5, concurrency=500, adaptive=False, per_host=None):
+        self.shards = shards or os.cpu_count() or 1
+        self.adaptive = adaptive  # each worker runs its own AdaptiveController
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.per_host = per_host  # None: each worker's scanner default
+        self.probes_done = 0
+        self._in_flight = {}  # shard index -> probes in flight at its last batch
+        self._context = multiprocessing.get_context("spawn")
+
+    async def scan_stream(self, targets, ports, open_only=True, prefilter=None):
+        """Same contract as AsyncScanner.scan_stream; the Prefilter is not supported across shards."""
+        if prefilter is not None:
+            raise ValueError("prefilter is only supported with a single-process scanner")
+        targets = targets.split(",") if isinstance(targets, str) else list(targets)
+        ports = list(ports) if not isinstance(ports, str) else ports
+        share = max(1, self.concurrency // self.shards)
+
+        workers, conns = [], []
+        for index in range(self.shards):
+            parent_conn, child_conn = self._context.Pipe(duplex=False)
+            proc = self._context.Process(
+                target=_shard_worker,
+                args=(child_conn, index, self.shards, targets, ports, share, self.timeout, open_only, self.adaptive,
+                      self.per_host),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            workers.append(proc)
+            conns.append(parent_conn)
+
+        loop = asyncio.get_running_loop()
+        # Bounded so a slow consumer stalls the reader thread, then the pipes, then the workers
+        queue = asyncio.Queue(maxsize=64)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_pipes, args=(conns, queue, loop, stop), daemon=True)
+        reader.start()
+
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+                (shard, probes_done, in_flight, outcomes), results = decode_batch(batch)
+                self.probes_done += probes_done
+                self._in_flight[shard] = in_flight
+                for outcome, n in outcomes.items():
+                    PROBES.inc(outcome, amount=n)
+                for ip, port, is_open in results:
+                    if is_open:
+                        logger.info(f"FIND: {ip}:{port} is OPEN")
+                    yield ip, port, is_open
+            # A worker that died closes its pipe just like one that finished; tell them apart
+            for index, proc in enumerate(workers):
+                await asyncio.to_thread(proc.join, 5)
+                if proc.exitcode != 0:
+                    raise RuntimeError(f"shard {index} did not finish cleanly (exit code {proc.exitcode})")
+        finally:
+            self._in_flight.clear()
+            stop.set()
+            for proc in workers:
+                if proc.is_alive():
+                    proc.terminate()
+            for proc in workers:
+                await asyncio.to_thread(proc.join, 5)
+            for conn in conns:
+                conn.close()
+
+    @property
+    def in_flight(self):
+        return sum(self._in_flight.values())
+
+    @staticmethod
+    def _read_pipes(conns, queue, loop, stop):
+        live = list(conns)
+        while live and not stop.is_set():
+            for conn in wait_connections(live, timeout=0.5):
+                try:
+                    data = conn.recv_bytes()
+                except (EOFError, OSError):
+                    live.remove(conn)
+                    continue
+                future = asyncio.run_coroutine_threadsafe(queue.put(data), loop)
+                while True:
+                    try:
+                        future.result(timeout=0.5)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        if stop.is_set():
+                            future.cancel()
+                            return
+        if not stop.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop)
+
+    async def scan_range(self, ip_range, ports, bitmap=False):
+        """Same contract as AsyncScanner.scan_range, spread across processes."""
+        findings = ScanResults()
+        async for ip, port, _ in self.scan_stream(ip_range, ports, open_only=True):
+            findings.add(ip, port)
+        for ip in expand_targets(ip_range):
+            findings.add_host(ip)
+        return findings if bitmap else findings.to_dict()
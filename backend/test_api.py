@@ -0,0 +1,92 @@
+import asyncio
+import os
+import queue
+import socket
+import sqlite3
+import tempfile
+import time
+
+# api opens its database at import time; keep the tests off the real one
+os.environ["GHOSTSCAN_DB"] = os.path.join(tempfile.mkdtemp(prefix="ghostscan-test-"), "ghostscan.db")
+
+import pytest
+from fastapi.testclient import TestClient
+import api
+from persistence import get_writer
+
+@pytest.fixture
+def client(monkeypatch):
+    async def no_intel(ips):
+        return {ip: {} for ip in ips}
+    monkeypatch.setattr(api.intel_bridge, "fetch_many", no_intel)
+    # The shutdown handler closes the shared writer and stops the job manager; undo both per client
+    writer = get_writer(api.DB_PATH)
+    monkeypatch.setattr(api, "db_writer", writer)
+    monkeypatch.setattr(api.intel_bridge, "writer", writer)
+    monkeypatch.setattr(api.job_manager, "stopping", False)
+    with TestClient(api.app) as client:
+        yield client
+
+@pytest.fixture
+def listener():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(16)
+    yield sock.getsockname()[1]
+    sock.close()
+
+def wait_for(client, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/scans/{job_id}").json()
+        if job["status"] in ("completed", "failed", "cancelled"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_sharded_scan_job(client, listener):
+    closed = listener + 1 if listener < 65535 else listener - 1
+    response = client.post("/scan", json={"ips": ["127.0.0.1"], "ports": [listener, closed], "shards": 2,
+                                          "adaptive": False})
+    assert response.status_code == 200
+    job = wait_for(client, response.json()["job_id"])
+    assert job["status"] == "completed", job
+    assert job["open_found"] == 1
+    results = client.get(f"/scans/{job['id']}/results").json()
+    assert results == {"127.0.0.1": [listener]}
+
+def test_prefilter_rejected_for_sharded_scans(client):
+    response = client.post("/scan", json={"ips": ["127.0.0.1"], "ports": [80], "shards": 2, "prefilter": True})
+    assert response.status_code == 422
+
+def test_out_of_range_ports_rejected(client):
+    response = client.post("/scan", json={"ips": ["127.0.0.1"], "ports": [80, 70000]})
+    assert response.status_code == 422
+
+def test_dead_shard_fails_the_scan(listener):
+    from sharding import ShardedScanner
+
+    async def run():
+        # Port 70000 does not fit the wire format, so its shard dies mid-scan
+        scanner = ShardedScanner(shards=2, timeout=0.2)
+        return [result async for result in scanner.scan_stream("127.0.0.1", [listener, 70000, listener], open_only=False)]
+
+    with pytest.raises(RuntimeError, match="did not finish cleanly"):
+        asyncio.run(run())
+
+def test_job_rows_written_when_writer_queue_is_full(client, listener, monkeypatch):
+    def full(sql, params=()):
+        raise queue.Full
+    # Every job row takes the overflow path, written in order by a task; the stand-in never starts the writer
+    api.db_writer.start()
+    monkeypatch.setattr(api.db_writer, "submit_nowait", full)
+    response = client.post("/scan", json={"ips": ["127.0.0.1"], "ports": [listener], "adaptive": False})
+    job = wait_for(client, response.json()["job_id"])
+    assert job["status"] == "completed", job
+    api.db_writer.flush()
+    conn = sqlite3.connect(api.DB_PATH)
+    try:
+        row = conn.execute("SELECT status FROM scan_jobs WHERE id = ?", (job["id"],)).fetchone()
+    finally:
+        conn.close()
+    assert row == ("completed",)
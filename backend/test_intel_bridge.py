@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+import sqlite3
+import time
+import types
+
+import pytest
+from aiohttp import web
+import intel_bridge
+from db import init_db
+from intel_bridge import IntelligenceBridge
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "intel.db")
+    init_db(path)
+    return path
+
+@contextlib.asynccontextmanager
+async def shodan(calls, missing=()):
+    """Local stand-in for the Shodan host endpoint; `calls` collects every IP looked up."""
+    async def host(request):
+        ip = request.match_info["ip"]
+        calls.append(ip)
+        await asyncio.sleep(0.05)
+        if ip in missing:
+            return web.json_response({"error": "No information available"}, status=404)
+        return web.json_response({"ip_str": ip, "ports": [22, 80]})
+
+    app = web.Application()
+    app.router.add_get("/shodan/host/{ip}", host)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+def bridge_for(url, db_path, **kwargs):
+    return IntelligenceBridge(shodan_key="test", base_url=url, db_path=db_path, **kwargs)
+
+def age_cache(db_path, seconds):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("UPDATE intel_cache SET timestamp = datetime(timestamp, ?)", (f"-{seconds} seconds",))
+    conn.close()
+
+def test_concurrent_lookups_share_one_upstream_call(db_path):
+    async def run():
+        calls = []
+        async with shodan(calls) as url, bridge_for(url, db_path) as bridge:
+            results = await asyncio.gather(*(bridge.fetch_ip_intel("192.0.2.1") for _ in range(5)))
+            many = await bridge.fetch_many(["192.0.2.2", "192.0.2.3", "192.0.2.2"])
+        return calls, results, many
+
+    calls, results, many = asyncio.run(run())
+    assert calls.count("192.0.2.1") == 1
+    assert all(intel == {"ip_str": "192.0.2.1", "ports": [22, 80]} for intel in results)
+    assert sorted(calls[1:]) == ["192.0.2.2", "192.0.2.3"]
+    assert many["192.0.2.3"]["ip_str"] == "192.0.2.3"
+
+def test_cache_tiers_expire(db_path, monkeypatch):
+    skew = [0]
+    # Only the bridge's clock moves; the event loop keeps the real one
+    monkeypatch.setattr(intel_bridge, "time", types.SimpleNamespace(monotonic=lambda: time.monotonic() + skew[0]))
+
+    async def run():
+        calls = []
+        async with shodan(calls) as url:
+            async with bridge_for(url, db_path, cache_ttl=3600) as bridge:
+                await bridge.fetch_ip_intel("192.0.2.1")
+                # In-process LRU: served even with the SQLite row gone
+                age_cache(db_path, 7200)
+                await bridge.fetch_ip_intel("192.0.2.1")
+                assert calls == ["192.0.2.1"]
+                # Past its TTL the LRU entry is dropped, and the stale SQLite row is skipped too
+                skew[0] += 3601
+                await bridge.fetch_ip_intel("192.0.2.1")
+                assert calls == ["192.0.2.1"] * 2
+            # A fresh process reads the SQLite tier and inherits what is left of the TTL
+            async with bridge_for(url, db_path, cache_ttl=3600) as bridge:
+                age_cache(db_path, 3000)
+                await bridge.fetch_ip_intel("192.0.2.1")
+                assert calls == ["192.0.2.1"] * 2
+                skew[0] += 601
+                age_cache(db_path, 601)
+                await bridge.fetch_ip_intel("192.0.2.1")
+                assert calls == ["192.0.2.1"] * 3
+
+    asyncio.run(run())
+
+def test_upstream_error_falls_back_to_mock_intel(db_path):
+    async def run():
+        calls = []
+        async with shodan(calls, missing={"192.0.2.9"}) as url, bridge_for(url, db_path) as bridge:
+            first = await bridge.fetch_ip_intel("192.0.2.9")
+            second = await bridge.fetch_ip_intel("192.0.2.9")
+        return calls, first, second
+
+    calls, first, second = asyncio.run(run())
+    assert first == second == IntelligenceBridge()._get_mock_intel("192.0.2.9")
+    # Fallbacks are not cached, so the next lookup asks upstream again
+    assert calls == ["192.0.2.9"] * 2
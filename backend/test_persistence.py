@@ -0,0 +1,62 @@
+import logging
+import sqlite3
+
+import pytest
+import persistence
+from persistence import BatchWriter
+
+INSERT = "INSERT INTO hosts (ip) VALUES (?)"
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "writer.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE hosts (ip TEXT PRIMARY KEY)")
+    conn.close()
+    return path
+
+def stored(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [ip for (ip,) in conn.execute("SELECT ip FROM hosts ORDER BY ip")]
+    finally:
+        conn.close()
+
+def test_bad_statement_drops_only_its_row(db_path, caplog, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(persistence.time, "sleep", sleeps.append)
+    writer = BatchWriter(db_path)
+    for ip in ("10.0.0.1", "10.0.0.2"):
+        writer.submit(INSERT, (ip,))
+    writer.submit("INSERT INTO missing (ip) VALUES (?)", ("10.0.0.3",))
+    for ip in ("10.0.0.4", "10.0.0.5"):
+        writer.submit(INSERT, (ip,))
+    with caplog.at_level(logging.ERROR, logger="persistence"):
+        writer.close()
+    assert stored(db_path) == ["10.0.0.1", "10.0.0.2", "10.0.0.4", "10.0.0.5"]
+    # A missing table is not a lock: no retries, one dropped row
+    assert sleeps == []
+    assert [record.message for record in caplog.records if "dropped" in record.message] == [
+        "DB write dropped (no such table: missing): INSERT INTO missing (ip) VALUES (?) ('10.0.0.3',)"]
+
+def test_locked_database_is_retried_then_dropped(db_path, caplog, monkeypatch):
+    monkeypatch.setattr(persistence, "PRAGMAS", persistence.PRAGMAS[:-1] + ("PRAGMA busy_timeout=10",))
+    monkeypatch.setattr(persistence, "RETRY_DELAY", 0.01)
+    writer = BatchWriter(db_path)
+    # Let the writer open its connection before the database is locked
+    writer.start().flush()
+    lock = sqlite3.connect(db_path, isolation_level=None)
+    lock.execute("BEGIN EXCLUSIVE")
+    for ip in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+        writer.submit(INSERT, (ip,))
+    with caplog.at_level(logging.WARNING, logger="persistence"):
+        writer.flush()
+    lock.execute("ROLLBACK")
+    lock.close()
+    messages = [record.message for record in caplog.records]
+    assert sum("retrying" in message for message in messages) == persistence.COMMIT_RETRIES
+    assert any(message.startswith("DB unavailable") and "dropped 3 writes" in message for message in messages)
+    # The writer carries on once the lock is gone
+    writer.submit(INSERT, ("10.0.0.4",))
+    writer.close()
+    assert stored(db_path) == ["10.0.0.4"]
@@ -0,0 +1,85 @@
+from scanner_core import HostLimit, ProbeCursor
+
+class ListSource:
+    def __init__(self, probes):
+        self.probes = iter(probes)
+        self.reported = []
+
+    def next_probe(self):
+        return next(self.probes, None)
+
+    def report(self, ip, port, outcome):
+        self.reported.append((ip, port))
+        return True
+
+def fill(source, window):
+    probes = []
+    while len(probes) < window:
+        probe = source.next_probe()
+        if probe is None:
+            break
+        probes.append(probe)
+    return probes
+
+def test_host_limit_refills_to_cap_after_batched_reports():
+    limit = HostLimit(ListSource([("10.0.0.1", port) for port in range(1, 1001)]), per_host=32)
+    in_flight = fill(limit, 500)
+    assert len(in_flight) == 32
+    for _ in range(5):
+        # A whole batch completes before the window is refilled, as in scan_probes
+        for probe in in_flight[:20]:
+            limit.report(*probe, "refused")
+        in_flight = in_flight[20:] + fill(limit, 500 - len(in_flight) + 20)
+        assert limit.in_flight["10.0.0.1"] == len(in_flight) == 32
+
+def test_host_limit_covers_every_probe_once():
+    probes = [(f"10.0.0.{host}", port) for host in range(1, 4) for port in range(1, 101)]
+    source = ListSource(probes)
+    limit = HostLimit(source, per_host=8)
+    while True:
+        batch = fill(limit, 50)
+        if not batch:
+            break
+        assert all(count <= 8 for count in limit.in_flight.values())
+        for probe in batch:
+            limit.report(*probe, "refused")
+    assert sorted(source.reported) == sorted(probes)
+    assert limit.held == 0
+
+def test_probe_cursor_resumes_without_gaps():
+    cursor = ProbeCursor(["10.0.0.0/29"], "1-20", per_host=4, spread=3)
+    handed = fill(cursor, 30)
+    for probe in handed[::2]:
+        cursor.report(*probe, "refused")
+    resumed = ProbeCursor(["10.0.0.0/29"], "1-20", cursor.position, per_host=4, spread=3)
+    rest = []
+    while True:
+        batch = fill(resumed, 30)
+        if not batch:
+            break
+        for probe in batch:
+            resumed.report(*probe, "refused")
+        rest += batch
+    assert set(handed[::2]) | set(rest) == {(f"10.0.0.{h}", p) for h in range(1, 7) for p in range(1, 21)}
+    assert resumed.completed == 6 * 20
+
+def test_probe_cursor_caps_hosts_only_while_they_share_the_window():
+    cursor = ProbeCursor(["10.0.0.1", "10.0.0.2"], "1-200", per_host=8)
+    handed = fill(cursor, 100)
+    assert len(handed) == 16
+    # Complete 10.0.0.2's probes as they go out; 10.0.0.1 stays capped until 10.0.0.2 runs out of ports
+    while ("10.0.0.2", 200) not in handed:
+        assert len(handed) == 16
+        for probe in [probe for probe in handed if probe[0] == "10.0.0.2"]:
+            cursor.report(*probe, "refused")
+        handed = [probe for probe in handed if probe[0] == "10.0.0.1"]
+        handed += fill(cursor, 100 - len(handed))
+    for probe in [probe for probe in handed if probe[0] == "10.0.0.2"]:
+        cursor.report(*probe, "refused")
+    handed = [probe for probe in handed if probe[0] == "10.0.0.1"]
+    handed += fill(cursor, 100 - len(handed))
+    assert len(handed) == 100
+
+def test_single_host_fills_the_window():
+    cursor = ProbeCursor(["10.0.0.1"], "1-2000", per_host=32)
+    assert len(fill(cursor, 500)) == 500
@@ -1,14 +1,36 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import axios from 'axios'
 import { Activity, Shield, Globe, Terminal, Search, Zap, List } from 'lucide-react'
 
 const API_BASE = 'http://localhost:8002'
+const MAX_DEVICES = 100
+const FINISHED = ['completed', 'cancelled', 'failed']
+
+// Applies a live update to one device row, moving it to the top of the list
+const upsertDevice = (devices, ip, update) => {
+  const existing = devices.find((d) => d.ip === ip) || { ip, ports: '', location: 'Pending' }
+  const rest = devices.filter((d) => d.ip !== ip)
+  return [update(existing), ...rest].slice(0, MAX_DEVICES)
+}
+
+const addPort = (ports, port) => {
+  const list = ports ? String(ports).split(',').map(Number) : []
+  if (!list.includes(port)) list.push(port)
+  return list.sort((a, b) => a - b).join(',')
+}
+
+const removePorts = (ports, removed) => {
+  const list = ports ? String(ports).split(',').map(Number) : []
+  return list.filter((p) => !removed.includes(p)).join(',')
+}
 
 function App() {
   const [devices, setDevices] = useState([])
   const [status, setStatus] = useState({ device_count: 0, engine: 'GhostScan v1.0' })
   const [scanTargets, setScanTargets] = useState('192.168.1.1/24')
   const [isScanning, setIsScanning] = useState(false)
+  const [job, setJob] = useState(null)
+  const activeJobId = useRef(null)
 
   const fetchStatus = async () => {
     try {
@@ -29,11 +51,15 @@ function App() {
     try {
       // Very simple expansion for the demo
       const ips = scanTargets.includes('/') ? [scanTargets] : scanTargets.split(',')
-      await axios.post(`${API_BASE}/scan`, {
+      const res = await axios.post(`${API_BASE}/scan`, {
         ips: ips,
         ports: [80, 443, 22, 3306, 8080]
       })
-      setTimeout(() => setIsScanning(false), 3000)
+      activeJobId.current = res.data.job_id
+      // The job may have finished before we knew its id
+      const snapshot = await axios.get(`${API_BASE}/scans/${res.data.job_id}`)
+      setJob(snapshot.data)
+      if (FINISHED.includes(snapshot.data.status)) setIsScanning(false)
     } catch (err) {
       console.error(err)
       setIsScanning(false)
@@ -43,11 +69,38 @@ function App() {
   useEffect(() => {
     fetchStatus()
     fetchDevices()
-    const interval = setInterval(() => {
+
+    // Live feed; EventSource resumes from the last event id on reconnect
+    const source = new EventSource(`${API_BASE}/events`)
+    const on = (kind, handler) => source.addEventListener(kind, (e) => handler(JSON.parse(e.data)))
+
+    on('discovery', ({ ip, port }) => {
+      setDevices((prev) => upsertDevice(prev, ip, (d) => ({ ...d, ports: addPort(d.ports, port) })))
+    })
+    on('device', ({ ip, location, services }) => {
+      setDevices((prev) => upsertDevice(prev, ip, (d) => ({ ...d, location, services: JSON.stringify(services) })))
+    })
+    // Incremental rescans: "opened" also arrives as a discovery event
+    on('diff', ({ ip, port, change, ports }) => {
+      if (change === 'opened') return
+      const removed = change === 'vanished' ? ports : [port]
+      setDevices((prev) => prev.map((d) => (d.ip === ip ? { ...d, ports: removePorts(d.ports, removed) } : d)))
+    })
+    on('counters', ({ device_count }) => {
+      setStatus((prev) => ({ ...prev, device_count }))
+    })
+    on('job', (snapshot) => {
+      if (snapshot.id !== activeJobId.current) return
+      setJob(snapshot)
+      if (FINISHED.includes(snapshot.status)) setIsScanning(false)
+    })
+    // Our cursor fell out of the server's history: reload the snapshot
+    on('reset', () => {
       fetchStatus()
       fetchDevices()
-    }, 5000)
-    return () => clearInterval(interval)
+    })
+
+    return () => source.close()
   }, [])
 
   return (
@@ -96,6 +149,14 @@ function App() {
               <span>Intelligence Hits</span>
               <span style={{ color: '#00ff9d' }}>{devices.length * 2}</span>
             </div>
+            {job && (
+              <div style={{ display: 'flex', justifyContent: 'space-between' }}>
+                <span>Scan Progress</span>
+                <span style={{ color: '#00ff9d' }}>
+                  {job.probes_done}/{job.probes_total} ({job.probes_per_sec}/s)
+                </span>
+              </div>
+            )}
             <div style={{ display: 'flex', justifyContent: 'space-between' }}>
               <span>Node Integrity</span>
               <span style={{ color: '#00ff9d' }}>99.8%</span>
@@ -121,7 +182,7 @@ function App() {
             <div>STATUS</div>
           </div>
           {devices.map((device) => (
-            <div key={device.id} className="device-row">
+            <div key={device.ip} className="device-row">
               <div className="ip">{device.ip}</div>
               <div className="ports">{device.ports}</div>
               <div className="location">{device.location}</div>
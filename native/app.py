@@ -2,13 +2,14 @@ import tkinter as tk
 import customtkinter as ctk
 import asyncio
 import threading
-import socket
 import logging
+import inspect
 import json
-import sqlite3
 import os
+import queue
 import aiohttp
 import random
+import sys
 from aiohttp_socks import ProxyConnector, open_connection as socks_open_connection
 from datetime import datetime
 from PIL import Image
@@ -22,21 +23,25 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "ghostscan_native.db")
 LOGO_PATH = os.path.join(BASE_DIR, "logo.png")
 
+# Shared engine modules live in the backend package
+sys.path.insert(0, os.path.abspath(os.path.join(BASE_DIR, "..", "backend")))
+from persistence import get_writer
+from adaptive import AdaptiveController
+from resolver import Resolver
+import db
+
+TOR_PROXY = "socks5://127.0.0.1:9050"
+
+# --- UI event pipeline ---
+UI_DRAIN_MS = 100 # one Tk callback drains everything queued since the last one
+UI_MAX_EVENTS = 5000 # per drain, so a burst of findings can't starve Tk
+LOG_MAX_LINES = 1000 # the log view is a ring buffer of the newest lines
+FIND_LINES_PER_DRAIN = 5 # individual FIND lines per drain; the rest are summarized
+
 # --- Database Logic ---
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS devices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip TEXT NOT NULL,
-            ports TEXT,
-            location TEXT,
-            last_seen DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    # Same hosts/host_ports schema as the backend; migrates the old devices table
+    db.init_db(DB_PATH)
 
 # --- Scanner Logic ---
 class AsyncScanner:
@@ -44,29 +49,55 @@ class AsyncScanner:
         self.timeout = timeout
         self.semaphore = asyncio.Semaphore(concurrency)
         self.proxy = proxy # e.g. "socks5://127.0.0.1:9050"
-
-    async def scan_port(self, ip, port):
+        # RTT-derived timeouts; one controller per route since Tor RTTs differ wildly
+        self.controllers = {}
+
+    @property
+    def controller(self):
+        return self.controller_for(self.proxy, self.timeout)
+
+    def controller_for(self, proxy, timeout):
+        key = proxy or "direct"
+        if key not in self.controllers:
+            self.controllers[key] = AdaptiveController(base_timeout=timeout, max_timeout=timeout * 3)
+        return self.controllers[key]
+
+    async def scan_port(self, ip, port, proxy=None, timeout=None):
+        # Per-call route and timeout, so concurrent scans on the shared runtime don't clash
+        proxy = proxy if proxy is not None else self.proxy
+        timeout = timeout or self.timeout
+        controller = self.controller_for(proxy, timeout)
         async with self.semaphore:
+            start = asyncio.get_running_loop().time()
             try:
-                if self.proxy:
+                if proxy:
                     # Port scanning over Tor (SOCKS5)
-                    proxy_host, proxy_port = self.proxy.replace("socks5://", "").split(":")
+                    proxy_host, proxy_port = proxy.replace("socks5://", "").split(":")
                     conn = socks_open_connection(proxy_host, int(proxy_port), ip, port)
                 else:
                     conn = asyncio.open_connection(ip, port)
                 
-                reader, writer = await asyncio.wait_for(conn, timeout=self.timeout)
+                reader, writer = await asyncio.wait_for(conn, timeout=controller.timeout_for(ip, timeout))
+                controller.observe(ip, "open", asyncio.get_running_loop().time() - start)
                 writer.close()
                 await writer.wait_closed()
                 return port, True
+            except asyncio.TimeoutError:
+                controller.observe(ip, "timeout")
+                return port, False
+            except ConnectionRefusedError:
+                controller.observe(ip, "refused", asyncio.get_running_loop().time() - start)
+                return port, False
             except:
+                controller.observe(ip, "error")
                 return port, False
 
-    async def scan_range(self, ip_range, ports, callback):
+    async def scan_range(self, ip_range, ports, callback, proxy=None, timeout=None):
+        """Scans every port on every IP; callback(ip, port) may be a coroutine function."""
         tasks = []
         for ip in ip_range:
             for port in ports:
-                tasks.append(self.scan_port(ip, port))
+                tasks.append(self.scan_port(ip, port, proxy=proxy, timeout=timeout))
         
         results = await asyncio.gather(*tasks)
         
@@ -76,7 +107,9 @@ class AsyncScanner:
             if is_open:
                 if ip not in findings: findings[ip] = []
                 findings[ip].append(port)
-                callback(ip, port)
+                result = callback(ip, port)
+                if inspect.isawaitable(result):
+                    await result
         return findings
 
 # --- Global Explorer (GIS Integration) ---
@@ -106,6 +139,68 @@ class GlobalExplorer:
         ]
         return mock_ips
 
+# --- Background Runtime ---
+class BackgroundRuntime:
+    """One long-lived event loop thread that owns the app's async resources.
+
+    The GUI hands it coroutines with submit() and gets concurrent.futures back,
+    so scans, lookups and the global recon loop all run side by side on one loop,
+    sharing the scanner (and its socket semaphore), pooled HTTP sessions per
+    route and the DB writer.
+    """
+    def __init__(self, db_path=DB_PATH):
+        self.loop = asyncio.new_event_loop()
+        self.scanner = AsyncScanner()
+        self.db_writer = get_writer(db_path)
+        self.resolver = Resolver()  # hostname targets, cached across scans
+        self._sessions = {}  # proxy URL or "direct" -> aiohttp.ClientSession
+        self._thread = threading.Thread(target=self._run, name="ghostscan-runtime", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro):
+        """Schedules a coroutine on the runtime loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def session(self, proxy=None):
+        """Pooled HTTP session for a route; created on first use, reused afterwards."""
+        key = proxy or "direct"
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            connector = ProxyConnector.from_url(proxy) if proxy else aiohttp.TCPConnector(limit=20)
+            session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=10))
+            self._sessions[key] = session
+        return session
+
+    async def _shutdown(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+    def stop(self, timeout=5):
+        if self._thread.is_alive():
+            try:
+                self.submit(self._shutdown()).result(timeout)
+            except Exception as e:
+                logger.warning(f"Runtime shutdown incomplete: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+        self.db_writer.close()
+
 # --- GUI Application ---
 class GhostScanApp(ctk.CTk):
     def __init__(self):
@@ -142,7 +237,7 @@ class GhostScanApp(ctk.CTk):
         self.ip_entry.insert(0, "127.0.0.1")
         self.ip_entry.grid(row=3, column=0, padx=20, pady=(5, 10))
 
-        self.scan_btn = ctk.CTkButton(self.sidebar, text="Initialize Scan", command=self.start_scan_thread)
+        self.scan_btn = ctk.CTkButton(self.sidebar, text="Initialize Scan", command=self.start_scan)
         self.scan_btn.grid(row=4, column=0, padx=20, pady=10)
 
         self.global_btn = ctk.CTkButton(self.sidebar, text="START GLOBAL RECON", fg_color="#ff00ff", hover_color="#cc00cc", command=self.toggle_global_recon)
@@ -178,31 +273,124 @@ class GhostScanApp(ctk.CTk):
 
         self.log_box = ctk.CTkTextbox(self.main_frame, font=ctk.CTkFont(family="Courier", size=12))
         self.log_box.grid(row=1, column=0, sticky="nsew")
-        
-        self.log_box.insert("end", f"[{datetime.now().strftime('%H:%M:%S')}] Console Initialized. Ready for Recon.\n")
 
-        # Async loop for background tasks
-        self.loop = asyncio.new_event_loop()
-        self.scanner = AsyncScanner()
+        # Live totals instead of one log line per open port
+        self.stats_label = ctk.CTkLabel(self.main_frame, text="", anchor="w", font=ctk.CTkFont(family="Courier", size=12))
+        self.stats_label.grid(row=2, column=0, sticky="ew", pady=(10, 0))
+
+        # Any thread posts here; drain_events renders it on the Tk thread in batches
+        self.ui_events = queue.SimpleQueue()
+        self.log_lines = 0
+        self.open_ports = 0
+        self.hosts_found = set()
+        self.last_find = None
+        self._drain_job = None
+        self.add_log("Console Initialized. Ready for Recon.")
+        self.drain_events()
+
+        # One background loop thread runs every async action
+        self.runtime = BackgroundRuntime(DB_PATH).start()
+        self.scanner = self.runtime.scanner
+        self.db_writer = self.runtime.db_writer
         self.explorer = GlobalExplorer(self.add_log)
         self.is_global_active = False
+        self.global_future = None
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        self.is_global_active = False
+        if self._drain_job is not None:
+            self.after_cancel(self._drain_job)
+            self._drain_job = None
+        # Cancels whatever is still running, closes sessions, flushes the DB writer
+        self.runtime.stop()
+        self.destroy()
+
+    def run_async(self, coro, label):
+        """Runs a coroutine on the runtime; failures end up in the log."""
+        future = self.runtime.submit(coro)
+
+        def report(done):
+            if not done.cancelled() and done.exception() is not None:
+                self.add_log(f"{label} ERROR: {done.exception()}")
+        future.add_done_callback(report)
+        return future
+
+    # --- Thread-safe UI updates: callable from any thread ---
+    def post(self, kind, *payload):
+        self.ui_events.put((kind, payload))
 
     def add_log(self, msg):
-        ts = datetime.now().strftime("%H:%M:%S")
-        self.log_box.insert("end", f"[{ts}] {msg}\n")
+        self.post("log", f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+
+    def set_status(self, text, color):
+        self.call_ui(self.status_label.configure, text=text, text_color=color)
+
+    def call_ui(self, func, *args, **kwargs):
+        self.post("call", func, args, kwargs)
+
+    def drain_events(self):
+        try:
+            self._drain_once()
+        finally:
+            # Re-armed even if a callback failed, or the log would stop updating for good
+            delay = 1 if not self.ui_events.empty() else UI_DRAIN_MS
+            self._drain_job = self.after(delay, self.drain_events)
+
+    def _drain_once(self):
+        lines, finds, calls = [], [], []
+        for _ in range(UI_MAX_EVENTS):
+            try:
+                kind, payload = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "log":
+                lines.append(payload[0])
+            elif kind == "find":
+                finds.append(payload)
+            elif kind == "call":
+                calls.append(payload)
+
+        if finds:
+            self.open_ports += len(finds)
+            self.hosts_found.update(ip for ip, _ in finds)
+            self.last_find = finds[-1]
+            ts = datetime.now().strftime("%H:%M:%S")
+            lines.extend(f"[{ts}] FIND: {ip}:{port} is OPEN [UNMASKED]" for ip, port in finds[:FIND_LINES_PER_DRAIN])
+            if len(finds) > FIND_LINES_PER_DRAIN:
+                lines.append(f"[{ts}] FIND: +{len(finds) - FIND_LINES_PER_DRAIN} more open ports")
+            ip, port = self.last_find
+            self.stats_label.configure(
+                text=f"OPEN PORTS: {self.open_ports}  |  HOSTS: {len(self.hosts_found)}  |  LAST: {ip}:{port}")
+        if lines:
+            try:
+                self.render_log(lines)
+            except Exception:
+                logger.exception("Rendering the log failed")
+        for func, args, kwargs in calls:
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception(f"UI callback {getattr(func, '__name__', func)} failed")
+
+    def render_log(self, lines):
+        lines = lines[-LOG_MAX_LINES:]
+        self.log_box.insert("end", "\n".join(lines) + "\n")
+        self.log_lines += len(lines)
+        if self.log_lines > LOG_MAX_LINES:
+            # Drop the oldest lines; the textbox never holds more than LOG_MAX_LINES
+            self.log_box.delete("1.0", f"{self.log_lines - LOG_MAX_LINES + 1}.0")
+            self.log_lines = LOG_MAX_LINES
         self.log_box.see("end")
 
-    def on_discovery(self, ip, port):
-        msg = f"FIND: {ip}:{port} is OPEN [UNMASKED]"
-        self.after(10, lambda: self.add_log(msg))
-        
-        # Save to DB
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("INSERT INTO devices (ip, ports, location) VALUES (?, ?, ?)", (ip, str(port), "Local/Simulated"))
-        conn.commit()
-        conn.close()
+    async def on_discovery(self, ip, port):
+        self.post("find", ip, port)
 
-    def start_scan_thread(self):
+        # Save to DB via the batched writer; a full queue waits off-loop
+        await self.db_writer.submit_async(db.UPSERT_HOST, (ip, None, "Local/Simulated", "native"))
+        await self.db_writer.submit_async(db.UPSERT_PORT, (ip, port))
+
+    def start_scan(self):
         targets = self.ip_entry.get()
         self.add_log(f"Starting Scan on {targets}...")
         self.status_label.configure(text="SYSTEM: SCANNING", text_color="#ffcc00")
@@ -211,18 +399,25 @@ class GhostScanApp(ctk.CTk):
         ips = [t.strip() for t in targets.split(",")]
         ports = [22, 80, 443, 3389, 8000, 8080, 8443]
         
-        # Configure scanner with current proxy settings
-        proxy_url = "socks5://127.0.0.1:9050" if self.stealth_var.get() else None
-        self.scanner.proxy = proxy_url
-        self.scanner.timeout = 2.0 if proxy_url else 1.0 # Tor is slower
-        
-        def run_async():
-            asyncio.set_event_loop(self.loop)
-            self.loop.run_until_complete(self.scanner.scan_range(ips, ports, self.on_discovery))
-            self.after(10, lambda: self.status_label.configure(text="SYSTEM: STANDBY", text_color="#00ff9d"))
-            self.after(10, lambda: self.add_log("Scan Complete."))
+        # Route and timeout are fixed per scan, read from the GUI now
+        proxy_url = TOR_PROXY if self.stealth_var.get() else None
+        timeout = 2.0 if proxy_url else 1.0 # Tor is slower
+
+        async def scan():
+            targets = ips
+            if proxy_url is None:
+                # Through Tor the proxy resolves names itself, so nothing leaks to the local DNS
+                targets, _, unresolved = await self.runtime.resolver.expand(ips)
+                if unresolved:
+                    self.add_log(f"[-] UNRESOLVED: {', '.join(unresolved)}")
+            try:
+                await self.scanner.scan_range(targets, ports, self.on_discovery, proxy=proxy_url, timeout=timeout)
+            finally:
+                self.set_status("SYSTEM: STANDBY", "#00ff9d")
+            stats = self.scanner.controller_for(proxy_url, timeout).snapshot(top=0)
+            self.add_log(f"Scan Complete. [RTT {stats['srtt']}s | TIMEOUT {stats['default_timeout']}s]")
 
-        threading.Thread(target=run_async, daemon=True).start()
+        return self.run_async(scan(), "SCAN")
 
     def toggle_stealth(self):
         active = self.stealth_var.get()
@@ -235,21 +430,19 @@ class GhostScanApp(ctk.CTk):
 
     def verify_identity(self):
         self.add_log("Verifying outgoing IP signature...")
+        proxy = TOR_PROXY if self.stealth_var.get() else None
         
         async def check_ip():
-            proxy = "socks5://127.0.0.1:9050" if self.stealth_var.get() else None
-            connector = ProxyConnector.from_url(proxy) if proxy else None
-            
             try:
-                async with aiohttp.ClientSession(connector=connector) as session:
-                    async with session.get("https://api.ipify.org?format=json", timeout=10) as resp:
-                        data = await resp.json()
-                        ip = data.get("ip")
-                        self.after(10, lambda: self.add_log(f"CURRENT IDENTITY: {ip}"))
+                session = await self.runtime.session(proxy)
+                async with session.get("https://api.ipify.org?format=json") as resp:
+                    data = await resp.json()
+                    ip = data.get("ip")
+                    self.add_log(f"CURRENT IDENTITY: {ip}")
             except Exception as e:
-                self.after(10, lambda: self.add_log(f"IDENTITY ERROR: {str(e)}"))
+                self.add_log(f"IDENTITY ERROR: {str(e)}")
 
-        threading.Thread(target=lambda: asyncio.run(check_ip()), daemon=True).start()
+        return self.run_async(check_ip(), "IDENTITY")
 
     def toggle_global_recon(self):
         if not self.is_global_active:
@@ -258,66 +451,62 @@ class GhostScanApp(ctk.CTk):
             self.stealth_var.set(True) # Force stealth
             self.toggle_stealth()
             self.add_log("CENTRAL INTELLIGENCE: Initializing Global Recon Loop...")
-            threading.Thread(target=self.run_global_loop, daemon=True).start()
+            self.global_future = self.run_async(self.global_recon(), "GLOBAL RECON")
         else:
             self.is_global_active = False
+            # Cancelling the future cancels the task on the runtime loop
+            if self.global_future is not None:
+                self.global_future.cancel()
+                self.global_future = None
             self.global_btn.configure(text="START GLOBAL RECON", fg_color="#ff00ff")
             self.add_log("CENTRAL INTELLIGENCE: Halting Global Recon.")
 
-    def run_global_loop(self):
-        asyncio.set_event_loop(self.loop)
+    async def global_recon(self):
         while self.is_global_active:
             topic = self.explorer.brainstorm()
-            targets = self.loop.run_until_complete(self.explorer.harvest(topic))
+            targets = await self.explorer.harvest(topic)
             
-            self.after(10, lambda: self.add_log(f"TARGETS ACQUIRED: Scanning {len(targets)} global nodes..."))
+            self.add_log(f"TARGETS ACQUIRED: Scanning {len(targets)} global nodes...")
             
             # Use Tor for global scans
-            self.scanner.proxy = "socks5://127.0.0.1:9050"
-            self.scanner.timeout = 2.0
-            
             ports = [80, 443, 22, 8080]
-            self.loop.run_until_complete(self.scanner.scan_range(targets, ports, self.on_discovery))
+            await self.scanner.scan_range(targets, ports, self.on_discovery, proxy=TOR_PROXY, timeout=2.0)
             
-            self.loop.run_until_complete(asyncio.sleep(10)) # Interval between waves
+            await asyncio.sleep(10) # Interval between waves
 
     def resolve_target_intel(self):
         target = self.intel_entry.get()
         if not target: return
         
         self.add_log(f"[*] INITIALIZING INTEL GATHERING: {target}")
+        proxy = TOR_PROXY if self.stealth_var.get() else None
         
-        def run_resolve():
-            # 1. Resolve IP
-            try:
-                ip = socket.gethostbyname(target)
-                self.after(10, lambda: self.add_log(f"[+] RESOLVED IP: {ip}"))
-            except:
-                self.after(10, lambda: self.add_log(f"[-] RESOLUTION FAILED: {target}"))
+        async def resolve():
+            # 1. Resolve IP (cached, shared with scan targets)
+            addrs = await self.runtime.resolver.resolve(target)
+            if not addrs:
+                self.add_log(f"[-] RESOLUTION FAILED: {target}")
                 return
+            ip = addrs[0]
+            self.add_log(f"[+] RESOLVED IP: {ip}")
 
             # 2. Fetch GeoIP (Direct or Tor depending on stealth)
-            async def fetch_geo():
-                proxy = "socks5://127.0.0.1:9050" if self.stealth_var.get() else None
-                connector = ProxyConnector.from_url(proxy) if proxy else None
-                try:
-                    async with aiohttp.ClientSession(connector=connector) as session:
-                        async with session.get(f"http://ip-api.com/json/{ip}", timeout=10) as resp:
-                            data = await resp.json()
-                            if data.get("status") == "success":
-                                info = f"MAP: {data.get('city')}, {data.get('country')} | ISP: {data.get('isp')}"
-                                self.after(10, lambda: self.add_log(f"[+] {info}"))
-                                # Auto-inject into scan entry
-                                self.after(10, lambda: self.ip_entry.delete(0, 'end'))
-                                self.after(10, lambda: self.ip_entry.insert(0, ip))
-                            else:
-                                self.after(10, lambda: self.add_log("[-] GEO-DATA UNAVAILABLE"))
-                except Exception as e:
-                    self.after(10, lambda: self.add_log(f"[-] GEO-ERROR: {str(e)}"))
-
-            asyncio.run(fetch_geo())
-
-        threading.Thread(target=run_resolve, daemon=True).start()
+            try:
+                session = await self.runtime.session(proxy)
+                async with session.get(f"http://ip-api.com/json/{ip}") as resp:
+                    data = await resp.json()
+                    if data.get("status") == "success":
+                        info = f"MAP: {data.get('city')}, {data.get('country')} | ISP: {data.get('isp')}"
+                        self.add_log(f"[+] {info}")
+                        # Auto-inject into scan entry
+                        self.call_ui(self.ip_entry.delete, 0, "end")
+                        self.call_ui(self.ip_entry.insert, 0, ip)
+                    else:
+                        self.add_log("[-] GEO-DATA UNAVAILABLE")
+            except Exception as e:
+                self.add_log(f"[-] GEO-ERROR: {str(e)}")
+
+        return self.run_async(resolve(), "INTEL")
 
 if __name__ == "__main__":
     init_db()